@@ -22,6 +22,13 @@ setup(
                       'matplotlib==3.8.3',
                       'biopython',
                       'geopandas',
+                      'shapely>=2.0',
+                      'pyarrow',
+                      'pyogrio',
+                      'contextily',
+                      'mercantile',
+                      'requests',
+                      'pillow',
                       #'pyqt5',
                       #'PyQtWebEngine',
                       #'toytree==2.0.5',
@@ -47,11 +47,7 @@ from shapely.geometry import Polygon, Point
 #from bokeh.tile_providers import Vendors
 from . import tools
 
-providers = [
-    "CartoDB Positron",
-    "OpenStreetMap Mapnik",
-    "Esri World Imagery"
-]
+providers = core.providers
 speciesmarkers = {'Bovine':'circle','Badger':'square',
                   'Deer':'triangle','Ovine':'diamond',None:'x'}
 
@@ -295,9 +291,12 @@ def add_legend(p, gdf, col, fontsize=14):
 def plot_setts(gdf, p):
     """Add circles for setts where there are badger samples"""
 
-    b = gdf[gdf.Species=='Badger']
-    grouped = b.groupby('HERD_NO')['geometry'].apply(lambda x: x.unary_union.centroid)
-    centroids_gdf = gpd.GeoDataFrame(grouped, geometry='geometry', crs=gdf.crs).reset_index()
+    b = gdf[(gdf.Species=='Badger') & ~(gdf.is_empty | gdf.geometry.isna())]
+    #centroid of the distinct points in each herd from the coordinates, no unions
+    xy = pd.DataFrame({'HERD_NO': b.HERD_NO, 'x': b.geometry.x, 'y': b.geometry.y}).drop_duplicates()
+    c = xy.groupby('HERD_NO')[['x','y']].mean()
+    centroids_gdf = gpd.GeoDataFrame({'HERD_NO': c.index},
+                            geometry=gpd.points_from_xy(c.x, c.y), crs=gdf.crs)
     geojson = centroids_gdf.to_crs('EPSG:3857').to_json()
     source = GeoJSONDataSource(geojson=geojson)
     r = p.scatter('x', 'y', source=source, line_width=1, color=None,
@@ -344,21 +343,15 @@ def plot_moves(p, moves, lpis_cent, limit=300, name='moves'):
     if len(groups) > limit:
         print ('too many moves')
         return
-    for tag,t in groups:
-        if t is not None:
-            #print (t)
-            moved = lpis_cent[lpis_cent.SPH_HERD_N.isin(t.move_to)].to_crs('EPSG:3857')
-            coords = tools.get_coords_data(t)
-            if len(coords)>0:
-                mlines = gpd.GeoDataFrame(geometry=coords)
-                #print (t)
-                for i,l in mlines.iterrows():
-                    #print (list(l.geometry.coords))
-                    p1 =  l.geometry.coords[0]
-                    p2 =  l.geometry.coords[1]
-                    p.add_layout(Arrow(end=nh, line_color='black', line_dash=[10, 5],
-                               x_start=p1[0], y_start=p1[1], x_end=p2[0], y_end=p2[1],
-                               name=name))
+    #all arrows from one source instead of a layout per move
+    seg = tools.get_move_segments(moves)
+    if len(seg) == 0:
+        return p
+    source = ColumnDataSource(data=dict(x_start=seg[:,0], y_start=seg[:,1],
+                                        x_end=seg[:,2], y_end=seg[:,3]))
+    p.add_layout(Arrow(end=nh, line_color='black', line_dash=[10, 5], source=source,
+                       x_start='x_start', y_start='y_start', x_end='x_end', y_end='y_end',
+                       name=name))
     return p
 
 def plot_group_symbols(gdf, p, lw=4, ms=50):
@@ -426,26 +419,24 @@ def get_timeline_data(mov, meta, limit=300):
     cols = ['move_to','move_date','end_date','data_type','duration','sample']
     mcols = ['sample']#,'snp5','snp7']
     cols = cols+mcols
-    new = []
     #default end date if no death
     end = datetime(2022, 12, 31)
     groups = mov.groupby('tag')
     if len(groups)>limit:
         return
-    for tag,t in groups:
-        if len(t)==1:
-            t['end_date'] = end
-        else:
-            t = t.sort_values('move_date')
-            t['end_date'] = t.move_date.shift(-1)
-        t['duration'] = t.end_date-t.move_date
-        #combine meta data for sample
-        row = meta[meta.Animal_ID==tag].iloc[0]
-        t[mcols] = row[mcols]
-        #print (tag)
-        #print (t[cols])
-        new.append(t[cols])
-    df = pd.concat(new).reset_index()
+    #all animals at once: each stay ends at the next move of the same tag
+    df = mov.reset_index().sort_values(['tag','move_date'], kind='stable')
+    tags = df.tag.to_numpy()
+    same = np.append(tags[1:] == tags[:-1], False)
+    df['end_date'] = df.move_date.shift(-1).where(same)
+    single = df.groupby('tag').tag.transform('size') == 1
+    df.loc[single, 'end_date'] = end
+    df['duration'] = df.end_date-df.move_date
+    #combine meta data for sample
+    first = meta.drop_duplicates('Animal_ID').set_index('Animal_ID')
+    for c in mcols:
+        df[c] = df.tag.map(first[c])
+    df = df[['tag']+cols].reset_index(drop=True)
     return df
 
 def plot_moves_timeline(df, height=300):
@@ -20,10 +20,6 @@
 
 import sys,os,subprocess,glob,shutil,re,random
 import platform
-from Bio.SeqRecord import SeqRecord
-from Bio.Seq import Seq
-from Bio import SeqIO
-from Bio import Phylo, AlignIO
 import numpy as np
 import pandas as pd
 from  . import tools
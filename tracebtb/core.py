@@ -45,6 +45,13 @@ defaults = {
 for k in defaults:
     vars()[k] = defaults[k]
 
+#basemap tile providers
+providers = [
+    "CartoDB Positron",
+    "OpenStreetMap Mapnik",
+    "Esri World Imagery"
+]
+
 county_colors = {
     "Antrim": "#A0522D",   # Sienna
     "Armagh": "#6B8E23",   # Olive Drab
@@ -109,7 +116,7 @@ host_colors = {
     'Llama': '#FFCC00'
 }
 
-counties_gdf = gpd.read_file(os.path.join(data_path,'counties.shp')).to_crs("EPSG:3857")
+counties_gdf = tools.get_counties("EPSG:3857").copy()
 counties_gdf['geometry'] = counties_gdf.geometry.simplify(300)
 #hex grid of ireland
 iregrid = tools.create_hex_grid(counties_gdf,n_cells=30)
@@ -118,3 +125,11 @@ def git_version() -> str:
     """Get get version"""
     return subprocess.check_output(['git','describe','--tags']).decode('ascii').strip()
 
+
+def get_cpu_count():
+    """Number of CPUs this process can use, respects affinity in containers"""
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
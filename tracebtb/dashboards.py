@@ -13,6 +13,7 @@ import pickle
 import glob,io
 import json
 import math
+import numpy as np
 import pylab as plt
 import pandas as pd
 import geopandas as gpd
@@ -233,7 +234,7 @@ class Dashboard:
     def load_lpis(self, event=None):
 
         if self.lpis_master_file != None:
-            self.lpis = gpd.read_file(self.lpis_master_file).set_crs('EPSG:29902')
+            self.lpis = tools.read_parcels(self.lpis_master_file)
         return
 
     def setup_widgets(self):
@@ -814,15 +815,14 @@ class FullDashboard(Dashboard):
 
         minsize = self.clustersizeslider.value
         key = self.colorby_input.value
-        groups = df[key].value_counts()
-        groups = groups[groups>=minsize]
-        df = df[df[key].isin(groups.index)].copy()
-
+        #build one mask so the frame is only copied once
+        sizes = df.groupby(key)[key].transform('size')
+        mask = (sizes >= minsize).values
         start, end = self.timeslider.value
-        df = df[(df.Year>=start) & (df.Year<=end) | (df.Year.isnull())].copy()
+        mask &= ((df.Year>=start) & (df.Year<=end) | (df.Year.isnull())).values
         if self.homebredbox.value == True:
-            df = df[df.Homebred=='yes'].copy()
-        return df
+            mask &= (df.Homebred=='yes').values
+        return df[mask].copy()
 
     def set_provider(self, event=None):
         """Change map provider"""
@@ -852,7 +852,12 @@ class FullDashboard(Dashboard):
         groups = list(df.iloc[rows].index)
         #print (groups)
         key = self.groupby_input.value
-        sub = self.meta[self.meta[key].isin(groups)].copy()
+        #look up the rows of each group instead of scanning the column
+        index = tools.get_group_index(self.meta, key)
+        rows = [index[g] for g in groups if g in index]
+        if len(rows) == 0:
+            return
+        sub = self.meta.iloc[np.sort(np.concatenate(rows))].copy()
         self.update(sub=sub)
         self.add_to_history()
         return
@@ -867,7 +872,7 @@ class FullDashboard(Dashboard):
         transformer_to_latlon = Transformer.from_crs("EPSG:3857", "EPSG:29902", always_xy=True)
         xmin, ymin = transformer_to_latlon.transform(xmin, ymin)
         xmax, ymax = transformer_to_latlon.transform(xmax, ymax)
-        sub = self.meta.cx[xmin:xmax, ymin:ymax]
+        sub = tools.get_in_region(self.meta, xmin, xmax, ymin, ymax)
         self.update(sub=sub)
         self.add_to_history()
         return
@@ -876,7 +881,7 @@ class FullDashboard(Dashboard):
         """Select within radius of a center"""
 
         point = self.selected.union_all().centroid
-        distances = self.selected.geometry.apply(lambda x: x.distance(point))
+        distances = self.selected.distance(point)
         radius = distances.median()
         sub = self.meta[self.meta.geometry.distance(point) <= radius].copy()
         self.update(sub=sub)
@@ -1103,7 +1108,7 @@ class FullDashboard(Dashboard):
     def add_layer(self, filename, name):
         """Add a map layer"""
 
-        gdf = gpd.read_file(filename).to_crs('EPSG:3857')
+        gdf = gpd.read_file(filename, engine='pyogrio', use_arrow=True).to_crs('EPSG:3857')
         self.layers[name] = gdf
         self.layers_select.options = list(self.layers.keys())
         #save layer to file
@@ -1480,7 +1485,7 @@ class HerdSelectionDashboard(Dashboard):
 
         if len(parcels)>0:
             point = parcels.to_crs('EPSG:3857').iloc[0].geometry.centroid
-            x1,y1,x2,y2 = df.union_all().bounds
+            x1,y1,x2,y2 = df.total_bounds
             pad = (x2-x1)*pad
             parcels['color'], cm = tools.get_color_mapping(parcels, 'SPH_HERD_N', None)
             p = bokeh_plot.plot_lpis(parcels, fill_alpha=0.4, line_width=0.2)
@@ -1732,8 +1737,6 @@ class MovesDashboard(Dashboard):
         for start_date in date_range:
             end_date = start_date + pd.Timedelta(days=n_days - 1)
             df_slice = df[(df['move_date'] >= start_date.date()) & (df['move_date'] <= end_date.date())]
-            print(f"Data from {start_date} to {end_date}:\n", len(df_slice))
-            print (df_slice)
             bokeh_plot.plot_moves(p, df_slice, self.lpis_cent, limit=200, name='related')
         return
 
@@ -31,6 +31,7 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotlib.figure import Figure
 from . import widgets
 import geopandas as gpd
+import shapely
 
 home = os.path.expanduser("~")
 module_path = os.path.dirname(os.path.abspath(__file__)) #path to module
@@ -377,8 +378,11 @@ class GISViewer(QWidget):
             #labels
             if layer.column_label != '':
                 col = layer.column_label
-                df.apply(lambda x: ax.annotate(text=x[col],
-                    xy=x.geometry.centroid.coords[0], ha='right', fontsize=layer.labelsize),axis=1)
+                #all centroid coords in one call rather than per row
+                d = df[~(df.geometry.isna() | df.geometry.is_empty)]
+                coords = shapely.get_coordinates(d.geometry.centroid.values)
+                for xy, label in zip(coords, d[col].to_numpy()):
+                    ax.annotate(text=label, xy=xy, ha='right', fontsize=layer.labelsize)
             if name in limits:
                 lims = limits[name]
                 ax.set_xlim(lims[0])
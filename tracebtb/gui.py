@@ -22,7 +22,6 @@
 
 import sys,os,traceback,subprocess
 import glob,platform,shutil
-import pickle
 import threading,time
 import math
 from .qt import *
@@ -30,8 +29,12 @@ import pandas as pd
 import numpy as np
 import pylab as plt
 import matplotlib as mpl
-from . import core, widgets, webwidgets, tables, tools, plotting, bokeh_plot, trees
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+import matplotlib.transforms as mtransforms
+from . import core, widgets, tables, tools, plotting, trees
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point, LineString, Polygon, MultiPolygon
 
 #fix for browser display
@@ -43,7 +46,7 @@ logoimg = os.path.join(module_path, 'logo.svg')
 iconpath = os.path.join(module_path, 'icons')
 #settingspath = os.path.join(homepath, '.config','tracebtb')
 
-counties_gdf = gpd.read_file(os.path.join(data_path,'counties.shp')).to_crs("EPSG:29902")
+counties_gdf = tools.get_counties("EPSG:29902")
 counties = ['Clare','Cork','Cavan','Monaghan','Louth','Kerry','Meath','Wicklow']
 cladelevels = ['snp3','snp5','snp7','snp12','snp20','snp50','snp200','snp500']
 colormaps = ['Paired', 'Dark2', 'Set1', 'Set2', 'Set3',
@@ -89,33 +92,53 @@ dockstyle = '''
 #module level functions
 
 def show_labels(df, col, ax):
-    """Add labels to plot"""
-
-    if col == '': return
-    for x, y, label in zip(df.geometry.x, df.geometry.y, df[col]):
-        ax.annotate(label, xy=(x, y), xytext=(5, 0), textcoords="offset points",
-                    fontsize=8)
-    return
+    """Add labels to plot. Only points inside the current axis view are labelled.
+    Returns the text artists."""
+
+    annotations = []
+    if col == '': return annotations
+    #coords of the selection are kept between redraws and label changes,
+    #empty points are nan so fall outside the view below
+    xy = tools.get_point_coords(df, 'labels')
+    if xy is None:
+        df = df[~(df.geometry.isna() | df.geometry.is_empty)]
+        coords = shapely.get_coordinates(df.geometry.values)
+        xy = coords[:,0], coords[:,1]
+    x,y = xy
+    #plain str array with missing values as empty strings
+    labels = df[col].astype('string').to_numpy(dtype=object, na_value='')
+    #skip labels outside the view, these are wasted text artists
+    xmin,xmax = ax.get_xlim()
+    ymin,ymax = ax.get_ylim()
+    mask = (x>=min(xmin,xmax)) & (x<=max(xmin,xmax)) & (y>=min(ymin,ymax)) & (y<=max(ymin,ymax))
+    mask &= labels != ''
+    #plain text with one shared offset transform is lighter than an annotation per point
+    offset = mtransforms.offset_copy(ax.transData, fig=ax.figure, x=5, y=0, units='points')
+    text = ax.text
+    for x, y, label in zip(x[mask], y[mask], labels[mask]):
+        annotations.append(text(x, y, label, transform=offset, fontsize=8))
+    return annotations
 
 def plot_moves(moves, lpis_cent, ax, ms=80):
     """Show moves as lines on plot"""
 
-    colors = plotting.random_colors(250, seed=12)
-    i=0
     if moves is None:
         return
     moves = moves[moves.geometry.notnull()]
-    for tag,t in moves.groupby('tag'):
-        if t is not None:
-            #print (t[cols])
-            moved = lpis_cent[lpis_cent.SPH_HERD_N.isin(t.move_to)]
-            coords = tools.get_coords_data(t)
-            if len(coords)>0:
-                mlines = gpd.GeoDataFrame(geometry=coords)
-                mlines.plot(color='black',linewidth=.5,ax=ax)
-                moved.plot(color='none',ec='black',marker='s',
-                            markersize=ms,linewidth=.8,alpha=0.5,ax=ax)
-                i+=1
+    if len(moves) == 0:
+        return
+    seg = tools.get_move_segments(moves)
+    if len(seg) == 0:
+        return
+    #segments go straight into one collection, no geometries needed
+    ax.add_collection(LineCollection(seg.reshape(-1, 2, 2), colors='black', linewidths=.5))
+    #herds for animals with at least one move line
+    multi = moves.index.duplicated(keep=False)
+    cent = tools.get_lookup(lpis_cent, 'SPH_HERD_N')
+    moved = cent.loc[cent.index.intersection(moves.move_to[multi].dropna().unique())]
+    moved = moved[~(moved.is_empty | moved.geometry.isna())]
+    ax.scatter(moved.geometry.x, moved.geometry.y, s=ms, marker='s', facecolors='none',
+                edgecolors='black', linewidths=.8, alpha=0.5)
     return
 
 def plot_parcels(parcels, ax, col=None, cmap='Set1'):
@@ -213,19 +236,24 @@ def plot_moves_timeline(df, herdcolors=None, order=None, ax=None):
     #plt.tight_layout()
     return
 
-def jitter_points(r, scale=1):
-    """Jitter GeoDataFrame points, vector based function"""
+def jitter_points(gdf, scale=1):
+    """Jitter all GeoDataFrame points at once, empty points stay empty"""
 
-    a=np.random.normal(0,scale)
-    b=np.random.normal(0,scale)
-    if (r.geometry.is_empty): return r.geometry
-    x,y = r.geometry.x+a,r.geometry.y+b
-    return Point(x,y)
+    n = len(gdf)
+    x = gdf.geometry.x.to_numpy() + np.random.normal(0, scale, n)
+    y = gdf.geometry.y.to_numpy() + np.random.normal(0, scale, n)
+    pts = shapely.points(x, y)
+    empty = gdf.geometry.is_empty.to_numpy() | gdf.geometry.isna().to_numpy()
+    pts[empty] = np.asarray(gdf.geometry.values)[empty]
+    return gpd.GeoSeries(pts, index=gdf.index, crs=gdf.crs)
 
 def get_move_dates(df):
+    """Stays in each herd, ending at the next move date"""
 
-    df['end_date'] = df.move_date.shift(-1)
-    return df[['move_date','end_date','move_to']][:-1]
+    #slice the date column against itself, no temporary shifted column
+    dates = df.move_date.to_numpy()
+    return pd.DataFrame({'move_date': dates[:-1], 'end_date': dates[1:],
+                         'move_to': df.move_to.to_numpy()[:-1]}, index=df.index[:-1])
 
 class CustomTreeWidgetItem( QTreeWidgetItem ):
     def __init__(self, parent=None):
@@ -267,11 +295,28 @@ class App(QMainWindow):
 
         self.lpis_master = None
         self.lpis_master_file = None
+        self.lpis_index = None
+        self.group_index = None
         self.lpis_cent = None
         self.parcels = None
         self.neighbours = None
         self.sub = None
+        self.labels = []
+        self.point_artists = []
+        self.view_layers = None
+        self.view_data = None
+        self.basemap_fetches = {}
         #self.moves = None
+        #single shot timer so fast changes in plot options give one update
+        self._labels_timer = QtCore.QTimer(self)
+        self._labels_timer.setSingleShot(True)
+        self._labels_timer.setInterval(200)
+        self._labels_timer.timeout.connect(self.relabel_view)
+        self.labels_lims = None
+        self._update_timer = QtCore.QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(120)
+        self._update_timer.timeout.connect(self.update)
 
         self.main.setFocus()
         self.setCentralWidget(self.main)
@@ -283,12 +328,16 @@ class App(QMainWindow):
 
         self.new_project()
         self.running = False
+        self.saving = False
         self.title = None
+        self.update_count = 0
+        self._pending_update = False
+        self._update_waiting = False
+        self.threadpool = QtCore.QThreadPool()
         #self.load_test()
 
         if project != None:
             self.load_project(project)
-        self.threadpool = QtCore.QThreadPool()
         self.redirect_stdout()
         return
 
@@ -342,25 +391,36 @@ class App(QMainWindow):
         return
 
     def save_settings(self):
-        """Save GUI settings"""
-
-        self.settings.setValue('window_size', self.size())
-        self.settings.setValue('window_position', self.pos())
-        self.settings.setValue('iconsize', core.ICONSIZE)
-        self.settings.setValue('font', core.FONT)
-        self.settings.setValue('fontsize', core.FONTSIZE)
-        self.settings.setValue('dpi', core.DPI)
-        self.settings.setValue('facecolor', core.FACECOLOR)
-        self.settings.setValue('threads', core.THREADS)
-        self.settings.setValue('recent_files',','.join(self.recent_files))
+        """Save GUI settings, only values that changed are written"""
+
+        s = self.settings
+        values = {'window_size': self.size(), 'window_position': self.pos(),
+                  'iconsize': core.ICONSIZE, 'font': core.FONT,
+                  'fontsize': core.FONTSIZE, 'dpi': core.DPI,
+                  'facecolor': core.FACECOLOR, 'threads': core.THREADS,
+                  'recent_files': ','.join(self.recent_files)}
+        changed = False
+        for key in values:
+            val = values[key]
+            #stored numbers may come back as strings
+            old = s.value(key)
+            if old is not None and (old == val or str(old) == str(val)):
+                continue
+            s.setValue(key, val)
+            changed = True
         #print (self.settings)
-        self.settings.sync()
+        if changed == True:
+            s.sync()
         return
 
     def load_base_data(self):
         """Set reference map of counties"""
 
         self.counties = counties_gdf
+        #border segments are static so extract them once
+        parts = shapely.get_parts(self.counties.boundary.values)
+        self.county_lines = [shapely.get_coordinates(g) for g in parts]
+        self.counties_artist = None
         return
 
     def create_tool_bar(self):
@@ -460,17 +520,20 @@ class App(QMainWindow):
         l.addWidget(QLabel('Labels:'))
         l.addWidget(w)
         self.widgets['labels'] = w
+        w.currentIndexChanged.connect(self.update_labels)
         #color points by
         self.colorbyw = w = QComboBox(m)
         l.addWidget(QLabel('Color samples By:'))
         l.addWidget(w)
         w.setMaxVisibleItems(12)
+        w.currentIndexChanged.connect(self.schedule_update)
         self.widgets['colorby'] = w
         #color parcels by
         self.colorparcelsbyw = w = QComboBox(m)
         l.addWidget(QLabel('Color parcels by:'))
         l.addWidget(w)
         w.setMaxVisibleItems(12)
+        w.currentIndexChanged.connect(self.schedule_update)
         self.widgets['colorparcelsby'] = w
         #colormaps
         self.cmapw = w = QComboBox(m)
@@ -478,16 +541,19 @@ class App(QMainWindow):
         l.addWidget(w)
         w.addItems(colormaps)
         w.setCurrentText('Paired')
+        w.currentIndexChanged.connect(self.schedule_update)
         self.widgets['colormap'] = w
         #toggle cx
         self.mapproviderw = w = QComboBox(m)
         l.addWidget(QLabel('Context map:'))
         l.addWidget(w)
-        w.addItems(['']+bokeh_plot.providers)
+        w.addItems(['']+core.providers)
+        w.currentIndexChanged.connect(self.schedule_update)
         #self.widgets['context'] = w
         self.markersizew = w = QSpinBox(m)
         w.setRange(1,300)
         w.setValue(50)
+        w.valueChanged.connect(self.update_marker_size)
         l.addWidget(QLabel('Marker size:'))
         l.addWidget(w)
         l.addStretch()
@@ -554,16 +620,25 @@ class App(QMainWindow):
         groupby = self.groupbyw.currentText()
         if groupby not in df.columns:
             return
-        vals = df[groupby].value_counts()
-        #print (vals)
+        #group sizes come from the same cached index used to select a group
+        index = self.get_group_index(df, groupby)
         t = self.groupw
-        t.clear()
-        for g,size in vals.items():
-            item = CustomTreeWidgetItem(t)
+        #build items first and insert them in one go without repainting
+        items = []
+        for g,rows in index.items():
+            item = CustomTreeWidgetItem()
             item.setTextAlignment(0, QtCore.Qt.AlignLeft)
-            item.setText(0, str(g))
-            item.setText(1, str(size))
+            item.setText(0, g)
+            item.setText(1, str(len(rows)))
+            items.append(item)
+        #no sorting on insert, the items are sorted once at the end
+        t.setUpdatesEnabled(False)
+        t.setSortingEnabled(False)
+        t.clear()
+        t.addTopLevelItems(items)
         t.sortItems(0, QtCore.Qt.SortOrder(0))
+        t.setSortingEnabled(True)
+        t.setUpdatesEnabled(True)
         return
 
     def update_widgets(self):
@@ -706,57 +781,57 @@ class App(QMainWindow):
         """Create the menu bar for the application. """
 
         self.file_menu = QMenu('File', self)
-        icon = QIcon(os.path.join(iconpath,'document-new.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'document-new.svg'))
         self.file_menu.addAction('New Project', lambda: self.new_project(ask=True))
-        icon = QIcon(os.path.join(iconpath,'document-open.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'document-open.svg'))
         self.file_menu.addAction(icon, 'Open Project', self.load_project_dialog)
         self.recent_files_menu = QMenu("Recent Projects", self.file_menu)
         self.file_menu.addAction(self.recent_files_menu.menuAction())
-        icon = QIcon(os.path.join(iconpath,'save.svg'))
-        self.file_menu.addAction(icon, '&Save Project', self.save_project,
+        icon = widgets.getIcon(os.path.join(iconpath,'save.svg'))
+        self.file_menu.addAction(icon, '&Save Project', lambda: self.save_project(),
                 QtCore.Qt.CTRL + QtCore.Qt.Key_S)
-        self.file_menu.addAction('Save Project As', self.save_project_dialog)
-        icon = QIcon(os.path.join(iconpath,'application-exit.svg'))
+        self.file_menu.addAction('Save Project As', lambda: self.save_project_dialog())
+        icon = widgets.getIcon(os.path.join(iconpath,'application-exit.svg'))
         self.file_menu.addAction(icon, 'Quit', self.quit)
         self.menuBar().addMenu(self.file_menu)
 
         self.edit_menu = QMenu('Edit', self)
         self.menuBar().addMenu(self.edit_menu)
-        icon = QIcon(os.path.join(iconpath,'settings.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'settings.svg'))
         self.edit_menu.addAction(icon, 'Preferences', self.preferences)
 
         self.view_menu = QMenu('View', self)
         self.menuBar().addMenu(self.view_menu)
-        icon = QIcon(os.path.join(iconpath,'zoom-in.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'zoom-in.svg'))
         self.view_menu.addAction(icon, 'Zoom In', self.zoom_in,
                 QtCore.Qt.CTRL + QtCore.Qt.Key_Equal)
-        icon = QIcon(os.path.join(iconpath,'zoom-out.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'zoom-out.svg'))
         self.view_menu.addAction(icon, 'Zoom Out', self.zoom_out,
                 QtCore.Qt.CTRL + QtCore.Qt.Key_Minus)
 
         self.data_menu = QMenu('Data', self)
         self.menuBar().addMenu(self.data_menu)
         self.data_menu.addAction('Load Samples', lambda: self.load_samples())
-        icon = QIcon(os.path.join(iconpath,'shapefile.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'shapefile.svg'))
         self.data_menu.addAction(icon,'Load Parcels', self.load_parcels)
-        icon = QIcon(os.path.join(iconpath,'plot-moves.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'plot-moves.svg'))
         self.data_menu.addAction(icon, 'Load Moves', lambda: self.load_moves())
         self.data_menu.addAction('Load Alignment', lambda: self.load_alignment())
-        icon = QIcon(os.path.join(iconpath,'snp-dist.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'snp-dist.svg'))
         self.data_menu.addAction(icon, 'Load SNP Distance Matrix', lambda: self.load_snp_dist())
         self.data_menu.addAction('Load Simulated Data', lambda: self.load_folder())
         self.data_menu.addSeparator()
-        icon = QIcon(os.path.join(iconpath,'parcels-master.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'parcels-master.svg'))
         self.data_menu.addAction(icon, 'Set Master Parcels file', self.set_lpis_file)
-        icon = QIcon(os.path.join(iconpath,'shapefile.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'shapefile.svg'))
         self.data_menu.addAction(icon, 'Load Master Parcels', self.load_lpis_master)
-        icon = QIcon(os.path.join(iconpath,'parcels.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'parcels.svg'))
         self.data_menu.addAction(icon, 'Extract Parcels/Centroids', self.get_lpis_centroids)
-        icon = QIcon(os.path.join(iconpath,'find-parcel.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'find-parcel.svg'))
         self.data_menu.addAction(icon, 'Find Parcel', self.find_parcel)
-        icon = QIcon(os.path.join(iconpath,'clusters.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'clusters.svg'))
         self.data_menu.addAction(icon, 'Get Clusters from SNPs', self.get_clusters)
-        icon = QIcon(os.path.join(iconpath,'cow.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'cow.svg'))
         self.data_menu.addAction(icon, 'Count Animal Moves', self.count_animal_moves)
         self.data_menu.addSeparator()
 
@@ -771,16 +846,16 @@ class App(QMainWindow):
         #self.tools_menu.addAction(icon, 'Strain Typing', self.strain_typing)
         #icon = QIcon(os.path.join(iconpath,'cow.svg'))
         #self.tools_menu.addAction(icon, 'Show Herd Summary', self.herd_summary)
-        icon = QIcon(os.path.join(iconpath,'simulate.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'simulate.svg'))
         self.tools_menu.addAction(icon, 'Make Simulated Data', self.simulate_data)
-        icon = QIcon(os.path.join(iconpath,'pdf.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'pdf.svg'))
         self.tools_menu.addAction(icon,'Case Report', self.case_report)
 
         self.scratch_menu = QMenu('Scratchpad', self)
         self.menuBar().addMenu(self.scratch_menu)
-        icon = QIcon(os.path.join(iconpath,'scratchpad.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'scratchpad.svg'))
         self.scratch_menu.addAction(icon,'Show Scratchpad', lambda: self.show_scratchpad())
-        icon = QIcon(os.path.join(iconpath,'snapshot.svg'))
+        icon = widgets.getIcon(os.path.join(iconpath,'snapshot.svg'))
         self.scratch_menu.addAction(icon,'Plot to Scratchpad', lambda: self.save_to_scratchpad())
 
         self.selections_menu = QMenu('Selections', self)
@@ -831,31 +906,60 @@ class App(QMainWindow):
                     self.docks[name].hide()
         return
 
-    def save_project(self):
-        """Save project"""
+    def save_project(self, threaded=True):
+        """Save project. The file is written in a worker thread by default."""
 
         if self.proj_file == None:
-            self.save_project_dialog()
+            #the dialog saves the project once a file is chosen
+            self.save_project_dialog(threaded=threaded)
+            return
+        if self.saving == True:
+            if threaded == True:
+                print ('project is already being saved')
+                return
+            #wait for the running save before writing the file again
+            self.threadpool.waitForDone()
 
         filename = self.proj_file
         data={}
-        data['meta'] = self.meta_table.model.df
+        #copies of the tables that can be edited while the file is written
+        data['meta'] = self.meta_table.model.df.copy()
         keys = ['sub','moves','parcels','lpis_cent','aln','snpdist','selections','lpis_master_file']
         for k in keys:
             if hasattr(self, k):
                 data[k] = self.__dict__[k]
+        if data.get('sub') is not None:
+            data['sub'] = data['sub'].copy()
         data['scratch_items'] = self.scratch_items
-        data['fig'] = self.plotview.fig
         data['widget_values'] = widgets.getWidgetValues(self.widgets)
         dock_items = {}
         for action in self.dock_menu.actions():
             dock_items[action.text()] = action.isChecked()
         data['dock_items'] = dock_items
-        pickle.dump(data, open(filename,'wb'))
-        self.add_recent_file(filename)
+
+        def func():
+            tools.save_project(filename, data)
+
+        def completed():
+            self.saving = False
+            self.progressbar.setRange(0,1)
+            self.add_recent_file(filename)
+            print ('saved project %s' %filename)
+
+        #written here if another worker is already running
+        if threaded == False or self.running == True:
+            self.saving = True
+            try:
+                func()
+            finally:
+                self.saving = False
+            completed()
+        else:
+            self.saving = True
+            self.run_threaded_process(func, completed)
         return
 
-    def save_project_dialog(self):
+    def save_project_dialog(self, threaded=True):
         """Save as project"""
 
         options = QFileDialog.Options()
@@ -866,7 +970,7 @@ class App(QMainWindow):
             if not os.path.splitext(filename)[1] == '.tracebtb':
                 filename += '.tracebtb'
             self.proj_file = filename
-            self.save_project()
+            self.save_project(threaded=threaded)
             self.projectlabel.setText(filename)
         return
 
@@ -894,10 +998,27 @@ class App(QMainWindow):
         return
 
     def load_project(self, filename=None):
-        """Load project"""
+        """Load project. The file is read in a worker thread."""
 
         self.new_project()
-        data = pickle.load(open(filename,'rb'))
+        data = {}
+
+        def func():
+            data.update(tools.load_project(filename))
+
+        def completed():
+            self.progressbar.setRange(0,1)
+            if len(data) == 0:
+                print ('could not load project %s' %filename)
+                return
+            self.set_project_data(filename, data)
+
+        self.run_threaded_process(func, completed)
+        return
+
+    def set_project_data(self, filename, data):
+        """Set the current project from loaded project data"""
+
         keys = ['sub','moves','parcels','lpis_cent','aln','snpdist','selections','lpis_master_file']
         for k in keys:
             if k in data:
@@ -946,12 +1067,11 @@ class App(QMainWindow):
         """Load test dataset"""
 
         #metadata
-        df = pd.read_csv('testing/metadata.csv')
+        df = tools.read_csv('testing/metadata.csv', fast=True)
         #index_col = 'sample'
         #df.set_index(index_col,inplace=True)
 
-        for col in cladelevels:
-            df[col] = df[col].astype(str)
+        df = tools.clades_to_str(df, cladelevels)
         t = self.meta_table
         t.setDataFrame(df)
         t.resizeColumns()
@@ -962,7 +1082,7 @@ class App(QMainWindow):
         #snps
         #self.coresnps = pd.read_csv('testing/core_snps_mbovis.txt', sep=' ')
         #moves
-        self.moves= pd.read_csv('testing/moves.csv')
+        self.moves = tools.read_csv('testing/moves.csv', fast=True)
         return
 
     def set_lpis_file(self):
@@ -987,8 +1107,9 @@ class App(QMainWindow):
             self.processing_completed()
             self.update_data_status()
 
-        def func(progress_callback):
-            self.lpis_master = gpd.read_file(self.lpis_master_file).set_crs('EPSG:29902')
+        def func():
+            self.lpis_master = tools.read_parcels(self.lpis_master_file)
+            self.lpis_index = tools.get_herd_index(self.lpis_master)
         self.run_threaded_process(func, completed)
         return
 
@@ -1013,13 +1134,12 @@ class App(QMainWindow):
             if self.moves is not None:
                 herds.extend(self.moves.move_to)
             self.set_locations()
-            x = self.lpis_master
-            self.parcels = x[x.SPH_HERD_N.isin(herds)]
+            self.parcels = tools.get_herd_parcels(self.lpis_master, herds, self.lpis_index)
             print ('found %s parcels' %len(self.parcels))
             self.processing_completed()
             return
 
-        def func(progress_callback):
+        def func():
             self.lpis_cent = tools.calculate_parcel_centroids(self.lpis_master)
         print ('calculating centroids..')
         self.run_threaded_process(func, completed)
@@ -1036,7 +1156,7 @@ class App(QMainWindow):
             return
 
         lpis = self.lpis_master
-        m = lpis[lpis.SPH_HERD_N==herd]
+        m = tools.get_herd_parcels(lpis, [herd], self.lpis_index)
         if len(m) == 0:
             print ('no such herd no. found')
             return
@@ -1063,7 +1183,7 @@ class App(QMainWindow):
         lpis = self.lpis_master
         #add farms that are in current moves data aswell
         mov = tools.get_moves_bytag(self.sub, self.moves, self.lpis_cent)
-        m = lpis[lpis.SPH_HERD_N.isin(mov.SPH_HERD_N)]
+        m = tools.get_herd_parcels(lpis, mov.SPH_HERD_N, self.lpis_index)
         #combine both
         df = pd.concat([df,m])
 
@@ -1073,7 +1193,7 @@ class App(QMainWindow):
             print ('found %s parcels' %len(self.neighbours))
             return
 
-        def func(progress_callback):
+        def func():
 
             found = []
             for x in df.geometry:
@@ -1082,8 +1202,8 @@ class App(QMainWindow):
                 found.append(points)
 
             found = pd.concat(found).drop_duplicates()
-            p = lpis[lpis.SPH_HERD_N.isin(found.SPH_HERD_N)]
-            p['color'] = p.apply(tools.random_grayscale_color, 1)
+            p = tools.get_herd_parcels(lpis, found.SPH_HERD_N, self.lpis_index)
+            p['color'] = tools.random_grayscale_colors(len(p))
             self.neighbours = p
 
         print ('getting parcels at distance %s m..' %d)
@@ -1099,9 +1219,9 @@ class App(QMainWindow):
 
         xmin,xmax,ymin,ymax = self.plotview.get_plot_lims()
         lpis = self.lpis_master
-        p = lpis.cx[xmin:xmax, ymin:ymax]
+        p = tools.get_in_region(lpis, xmin, xmax, ymin, ymax)
         p = p[~p.SPH_HERD_N.isin(self.sub.HERD_NO)]
-        p['color'] = p.apply(tools.random_grayscale_color, 1)
+        p['color'] = tools.random_grayscale_colors(len(p))
         #p['color'] = tools.random_colormap_colors('GnBu',len(p))
         self.neighbours = p
         self.update()
@@ -1137,7 +1257,7 @@ class App(QMainWindow):
         """Get clades/clusters for samples"""
 
         from . import clustering
-        def func(progress_callback):
+        def func():
             if not hasattr(self, 'snpdist'):
                 if self.aln is not None:
                     print ('calculating snp matrix. may take some time..')
@@ -1163,10 +1283,8 @@ class App(QMainWindow):
         cols=['Animal_ID']+list(self.moves.columns)
         df = gdf.merge(self.moves,left_on='Animal_ID',right_on='tag',how='inner')[cols]
         df = df[df.data_type=='F_to_F']
-        g = df.Animal_ID.value_counts()
         g = df.groupby('Animal_ID').count()['id'].reset_index()
         g = g.rename(columns={'id':'moves'})
-        print (g)
         #put into main table
 
         gdf = gdf.merge(g, on='Animal_ID', how='left')
@@ -1187,11 +1305,9 @@ class App(QMainWindow):
                                             filter="csv file(*.csv *.txt);;All Files(*.*)")
             if not filename:
                 return
-        df = pd.read_csv(filename)
+        df = tools.read_csv(filename)
 
-        for col in cladelevels:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
+        df = tools.clades_to_str(df, cladelevels)
 
         #try to convert to geodataframe if has coords
         result = self.extract_coords(df)
@@ -1226,7 +1342,8 @@ class App(QMainWindow):
         kwds = dlg.values
         x=kwds['X']
         y=kwds['Y']
-        gdf = gpd.GeoDataFrame(df,geometry=gpd.points_from_xy(df[x], df[y])).set_crs('EPSG:29902')
+        geom = shapely.points(df[x].to_numpy(dtype='float64'), df[y].to_numpy(dtype='float64'))
+        gdf = gpd.GeoDataFrame(df, geometry=geom, crs='EPSG:29902')
         #jitter the points
         print ('jittering points')
         gdf = tools.apply_jitter(gdf, radius=100)
@@ -1240,7 +1357,7 @@ class App(QMainWindow):
                                         filter="csv file(*.csv *.txt);;All Files(*.*)")
             if not filename:
                 return
-        df = pd.read_csv(filename)
+        df = tools.read_csv(filename)
         cols = df.columns
         item, ok = QInputDialog.getItem(self, 'Select tag field', 'tag field:', cols, 0, False)
         df = df.rename(columns={item: 'tag'})
@@ -1278,7 +1395,7 @@ class App(QMainWindow):
                                         filter="csv file(*.csv *.txt);;All Files(*.*)")
             if not filename:
                 return
-        self.snpdist = pd.read_csv(filename,index_col=0)
+        self.snpdist = tools.read_csv(filename,index_col=0)
         print ('loaded dist matrix with %s rows' %len(self.snpdist))
         self.update_data_status()
         return
@@ -1289,7 +1406,7 @@ class App(QMainWindow):
         if filename == None:
             filename, _ = QFileDialog.getOpenFileName(self, 'Open Shapefile', './',
                                         filter="shapefile(*.shp);;All Files(*.*)")
-        df = gpd.read_file(filename)
+        df = gpd.read_file(filename, engine='pyogrio', use_arrow=True)
         #get herd_no column
         cols = df.columns
         if herdcol == None:
@@ -1333,7 +1450,7 @@ class App(QMainWindow):
         #parcels
         self.load_parcels(gdf_file, herdcol='herd', crs='EPSG:29902')
         #snp dist
-        self.snpdist = pd.read_csv(snp_file,index_col=0)
+        self.snpdist = tools.read_csv(snp_file,index_col=0)
         #movement
         self.load_moves(moves_file)
         self.update()
@@ -1351,8 +1468,11 @@ class App(QMainWindow):
         return
 
     def gdf_from_table(self, df, x='X_COORD',y='Y_COORD'):
+        """Make points from coordinate columns"""
 
-        cent = gpd.GeoDataFrame(df,geometry=gpd.points_from_xy(df[x], df[y])).set_crs('EPSG:29902')
+        #build all points in one call from float arrays and set crs directly
+        geom = shapely.points(df[x].to_numpy(dtype='float64'), df[y].to_numpy(dtype='float64'))
+        cent = gpd.GeoDataFrame(df, geometry=geom, crs='EPSG:29902')
         return cent
 
     def get_tabs(self):
@@ -1375,14 +1495,30 @@ class App(QMainWindow):
         """Execute a function in the background with a worker"""
 
         if self.running == True:
+            print ('another process is still running')
             return
+        self.running = True
         worker = widgets.Worker(fn=process)
-        self.threadpool.start(worker)
+        #connect before starting so a fast worker can't finish first,
+        #the flag is reset before on_complete so it can start a new worker
+        worker.signals.finished.connect(self.process_finished)
         worker.signals.finished.connect(on_complete)
-        worker.signals.progress.connect(self.progress_fn)
+        #show any output the worker left without a newline
+        if hasattr(self, '_stdout'):
+            worker.signals.finished.connect(self._stdout.flush)
+        self.threadpool.start(worker)
         self.progressbar.setRange(0,0)
         return
 
+    def process_finished(self):
+        """Allow new workers and run any update that waited for this one"""
+
+        self.running = False
+        if self._update_waiting == True:
+            self._update_waiting = False
+            self.update()
+        return
+
     def progress_fn(self, msg):
 
         self.info.append(msg)
@@ -1418,52 +1554,152 @@ class App(QMainWindow):
         return
 
     def update(self):
-        """Update plot"""
+        """
+        Request a plot update. Several calls in the same event loop pass,
+        e.g. from toggling toolbar buttons, give a single update.
+        """
 
-        mpl.pyplot.close()
-        self.plotview.clear()
-        ax = self.plotview.ax
-        fig = self.plotview.fig
-        self.set_background(core.FACECOLOR)
+        if self._pending_update == True:
+            return
+        self._pending_update = True
+        QtCore.QTimer.singleShot(0, self._do_update)
+        return
+
+    def schedule_update(self, *args):
+        """
+        Update after a short delay, restarting the timer if it is already
+        running so only the last of several quick changes is plotted.
+        """
 
+        self._update_timer.start()
+        return
+
+    def update_marker_size(self, *args):
+        """
+        Resize the sample markers in place and blit them over the cached
+        static layers instead of preparing and drawing the whole view again.
+        """
+
+        ax = self.plotview.ax
+        if len(self.point_artists) == 0 or self.view_layers is None \
+            or any(a.axes is not ax for a in self.point_artists):
+            self.schedule_update()
+            return
         ms = self.markersizew.value()
-        colorcol = self.colorbyw.currentText()
-        colorparcelscol = self.colorparcelsbyw.currentText()
-        cmap = self.cmapw.currentText()
-        legend = self.legendb.isChecked()
+        for a in self.point_artists:
+            a.set_sizes([ms])
+        static, key = self.view_layers
+        self.plotview.draw_layers(static, key)
+        return
+
+    def _do_update(self):
+        """
+        Update plot. The data for the view is prepared in a worker thread
+        and drawn on the main thread when ready.
+        """
 
+        self._pending_update = False
+        if self.running == True:
+            #plot once the current worker is done
+            self._update_waiting = True
+            return
+        mpl.pyplot.close()
         if self.sub is None or len(self.sub) == 0:
+            self.plotview.clear()
+            self.labels = []
+            self.point_artists = []
+            self.view_layers = None
+            self.view_data = None
             return
 
+        opts = {'colorcol': self.colorbyw.currentText(),
+                'colorparcelscol': self.colorparcelsbyw.currentText(),
+                'cmap': self.cmapw.currentText()}
+        sub = self.sub
+        self.update_count += 1
+        count = self.update_count
+        data = {}
+
+        def func():
+            data.update(self.get_view_data(sub, **opts))
+
+        def completed():
+            self.progressbar.setRange(0,1)
+            #skip if a newer update was requested in the meantime
+            if count != self.update_count or len(data) == 0:
+                return
+            self.draw_view(data, **opts)
+
+        self.run_threaded_process(func, completed)
+        return
+
+    def get_view_data(self, sub, colorcol='', colorparcelscol='', cmap=None):
+        """
+        Get colors, moves and parcels needed to plot a selection.
+        Does not access any widgets so it is safe to run in a thread.
+        """
+
         if colorcol != '':
             #assign colors to selection
-            clrs,c = tools.get_color_mapping(self.sub, colorcol, cmap)
+            clrs,c = tools.get_color_mapping(sub, colorcol, cmap)
         else:
             clrs = 'blue'
 
-        self.sub['color'] = clrs
-        if 'Species' in self.sub.columns:
-            self.sub['marker'] = self.sub.Species.map({'Bovine':'circle','Badger':'triangle'})
+        #new frame with colors so the selection itself is not changed from this thread
+        sub = sub.assign(color=clrs)
 
         #get moves here
         if hasattr(self, 'moves'):
-            mov = tools.get_moves_bytag(self.sub, self.moves, self.lpis_cent)
+            mov = tools.get_moves_bytag(sub, self.moves, self.lpis_cent)
         else:
             mov = None
 
         #get land parcels and colors
-        herds = list(self.sub.HERD_NO)
+        herds = list(sub.HERD_NO)
         #add parcels for intermediate herds if we have moves
         if mov is not None:
             herds.extend(mov.move_to)
-        parcels = self.parcels[self.parcels.SPH_HERD_N.isin(herds)]
+        index = tools.get_herd_index(self.parcels, cache=True)
+        parcels = tools.get_herd_parcels(self.parcels, herds, index)
         if colorparcelscol!='':
-            parcels['color'],c = tools.get_color_mapping(parcels, colorparcelscol, cmap)
+            pclrs,c = tools.get_color_mapping(parcels, colorparcelscol, cmap)
         else:
-            parcels['color'] = 'none'
+            pclrs = 'none'
+        parcels = parcels.assign(color=pclrs)
         herdcolors = dict(zip(parcels.SPH_HERD_N,parcels.color))
+        #bounds found here so the geometry scans stay off the main thread
+        pts = sub[~sub.is_empty & sub.geometry.notnull()]
+        bounds = pts.total_bounds
+        if len(parcels) > 0:
+            parcel_bounds = parcels.total_bounds
+        else:
+            parcel_bounds = None
+        return {'sub': sub, 'moves': mov, 'parcels': parcels, 'herdcolors': herdcolors,
+                'bounds': bounds, 'parcel_bounds': parcel_bounds}
+
+    def draw_view(self, data, colorcol='', colorparcelscol='', cmap=None):
+        """Draw the current selection using data from get_view_data"""
+
+        #canvas is drawn once at the end
+        self.plotview.clear(draw=False)
+        self.labels = []
+        ax = self.plotview.ax
+        fig = self.plotview.fig
+        self.set_background(core.FACECOLOR)
+        #kept so the view can be drawn again for the scratchpad
+        self.view_data = (data, {'colorcol': colorcol, 'colorparcelscol': colorparcelscol,
+                                 'cmap': cmap})
+
+        ms = self.markersizew.value()
+        legend = self.legendb.isChecked()
+        mov = data['moves']
+        parcels = data['parcels']
+        herdcolors = data['herdcolors']
+        #layers that only change with the view extent
+        static = []
+
         if self.showcountiesb.isChecked():
-            self.plot_counties()
+            static.append(self.plot_counties())
 
         if self.parcelsb.isChecked() and parcels is not None:
             plot_parcels(parcels, col=colorparcelscol, cmap=cmap, ax=ax)
@@ -1472,13 +1708,14 @@ class App(QMainWindow):
         #    self.get_neighbouring_parcels()
         if self.neighbours is not None and self.parcelsb.isChecked():
             #self.neighbours.plot(color='gray',alpha=0.4,ax=ax)
-            self.neighbours.plot(column='color',cmap='gray',alpha=0.4,ax=ax)
+            #colors are already set so no need to classify a column
+            self.neighbours.plot(color=self.neighbours.color,alpha=0.4,ax=ax)
 
-        plotting.plot_selection(self.sub,col=colorcol,ms=ms,cmap=cmap,legend=legend,ax=ax)
- 
-        labelcol = self.labelsw.currentText()
-        if labelcol != '':
-            show_labels(self.sub, labelcol, ax)
+        n = len(ax.collections)
+        plotting.plot_selection(data['sub'],col=colorcol,ms=ms,cmap=cmap,legend=legend,
+                                bounds=data['bounds'],ax=ax)
+        #keep the sample markers so they can be changed without a full update
+        self.point_artists = ax.collections[n:]
 
         leg = ax.get_legend()
         if leg != None:
@@ -1488,6 +1725,7 @@ class App(QMainWindow):
         if self.movesb.isChecked():
             if self.moves is None:
                 print ('no moves loaded')
+                self.plotview.redraw()
                 return
             plot_moves(mov, self.lpis_cent, ax=ax)
             self.show_moves_table(mov)
@@ -1513,26 +1751,106 @@ class App(QMainWindow):
             ax.set_ylim(lims[2],lims[3])
         #print (self.plotview.lims)
 
-        self.set_bounds(parcels)
-        set_equal_aspect(ax)
+        self.set_bounds(bounds=data['parcel_bounds'], redraw=False)
+        plotting.set_equal_aspect(ax)
         #fig.tight_layout()
 
-        self.plotview.redraw()
+        provider = self.mapproviderw.currentText()
+        if provider != '':
+            try:
+                #only use a cached basemap here, tiles are fetched in a thread
+                lims = ax.get_xlim() + ax.get_ylim()
+                image = plotting.get_context_map(provider, *lims, fetch=False)
+                if image is not None:
+                    static.append(plotting.add_context_map(ax, provider, image=image))
+                else:
+                    opts = {'colorcol': colorcol, 'colorparcelscol': colorparcelscol, 'cmap': cmap}
+                    self.fetch_context_map(provider, lims, data, opts)
+            except Exception as e:
+                print ('could not add context map: %s' %e)
+
+        #labels are left out of the background so they can be changed by blitting
+        labelcol = self.labelsw.currentText()
+        self.labels = show_labels(self.sub, labelcol, ax)
+        self.labels_lims = self.plotview.get_plot_lims()
+        self.plotview.set_overlay(self.labels)
+        #static layers are reused from the last draw if the view is the same
+        key = (provider, self.showcountiesb.isChecked(), core.FACECOLOR, self.title,
+                tuple(ax.get_position().bounds))
+        self.plotview.draw_layers(static, key)
+        self.view_layers = (static, key)
+        #labels only cover the view, so make them again after a pan or zoom
+        ax.callbacks.connect('xlim_changed', self.view_changed)
+        ax.callbacks.connect('ylim_changed', self.view_changed)
 
         #update subset table
         self.show_selected_table()
+        return
+
+    def fetch_context_map(self, provider, lims, data, opts):
+        """
+        Get the basemap for a view in a worker thread, then draw the view
+        again once it is cached. Skipped if the view changed meanwhile.
+        """
+
+        #the same tiles may already be downloading for an earlier update,
+        #then only the view to draw when they arrive is replaced
+        fetchkey = (provider,) + tuple(lims)
+        if fetchkey in self.basemap_fetches:
+            self.basemap_fetches[fetchkey] = (self.update_count, data, opts)
+            return
+        if self.running == True:
+            #update again when the other worker is done
+            self._update_waiting = True
+            return
+        self.basemap_fetches[fetchkey] = (self.update_count, data, opts)
+        result = {}
+
+        def func():
+            result['image'] = plotting.get_context_map(provider, *lims, threads=core.THREADS)
+
+        def completed():
+            self.progressbar.setRange(0,1)
+            count, data, opts = self.basemap_fetches.pop(fetchkey)
+            if count != self.update_count or 'image' not in result:
+                return
+            ax = self.plotview.ax
+            if ax.get_xlim() + ax.get_ylim() != lims:
+                return
+            self.draw_view(data, **opts)
+
+        self.run_threaded_process(func, completed)
+        return
+
+    def update_labels(self, *args):
+        """Change labels without a full redraw of the view"""
+
+        if self.sub is None or len(self.sub) == 0:
+            return
+        #labels are already gone if the plot was cleared
+        if self.plotview.background is not None:
+            for a in self.labels:
+                a.remove()
+        labelcol = self.labelsw.currentText()
+        self.labels = show_labels(self.sub, labelcol, self.plotview.ax)
+        self.labels_lims = self.plotview.get_plot_lims()
+        #a full draw is scheduled instead if the view was panned or resized
+        self.plotview.set_overlay(self.labels)
+        self.plotview.blit()
+        return
+
+    def view_changed(self, ax):
+        """Relabel once the view stops changing"""
+
+        self._labels_timer.start()
+        return
 
-        #update folium map
-        #if self.showfoliumb.isChecked():
-            #self.foliumview.plot(self.sub, self.parcels, colorcol=colorcol)
-            #self.show_folium()
+    def relabel_view(self):
+        """Update labels if the view moved since they were made"""
 
-        #update bokeh view
-        #provider = self.mapproviderw.currentText()
-        #if not self.movesb.isChecked() and self.moves is not None:
-        #    mov = None
-        #self.bokehview.plot(gdf=self.sub, parcels=parcels, provider=provider,
-        #                    moves=mov, lpis_cent=self.lpis_cent)
+        if self.plotview.get_plot_lims() == self.labels_lims:
+            return
+        self.update_labels()
         return
 
     def split_view(self):
@@ -1592,7 +1910,8 @@ class App(QMainWindow):
             herds = list(self.sub.HERD_NO)
             if mov is not None:
                 herds.extend(mov.move_to)
-            p = self.parcels[self.parcels.SPH_HERD_N.isin(herds)]
+            index = tools.get_herd_index(self.parcels, cache=True)
+            p = tools.get_herd_parcels(self.parcels, herds, index)
             p['color'],c = plotting.get_color_mapping(p, 'SPH_HERD_N', cmap)
 
         idx = list(self.sub.index)
@@ -1602,7 +1921,7 @@ class App(QMainWindow):
             #print (M)
             trees.tree_from_distmatrix(M, treefile)
 
-        def func(progress_callback):
+        def func():
             from . import reports
             reports.cluster_report(self.sub, p, self.lpis_cent, moves=mov,
                                     cmap=cmap, colorcol=colorcol, labelcol=labelcol, outfile=filename)
@@ -1628,7 +1947,14 @@ class App(QMainWindow):
         groups = [item.text(0) for item in self.groupw.selectedItems()]
         if len(groups) == 0:
             return
-        self.sub = gdf[gdf[key].isin(groups)].copy()
+        index = self.get_group_index(gdf, key)
+        rows = [index[g] for g in groups if g in index]
+        #iloc with positions already returns new frames and self.sub is
+        #never changed in place, views use assign
+        if len(rows) == 0:
+            self.sub = gdf.iloc[[]]
+        else:
+            self.sub = gdf.iloc[np.sort(np.concatenate(rows))]
         cl = ','.join(groups)
         self.title = '%s=%s n=%s' %(key,cl,len(self.sub))
         self.plotview.lims = None
@@ -1638,14 +1964,32 @@ class App(QMainWindow):
         self.add_to_history()
         return
 
+    def get_group_index(self, df, key):
+        """
+        Row positions of each group in a column, keyed by the group name as shown
+        in the groups widget. Cached until the table or column changes.
+        """
+
+        #share the grouping already made for the groups list, a new one
+        #is made there if the table was edited
+        groups = tools.get_group_index(df, key)
+        if self.group_index is None or self.group_index[0] is not groups:
+            index = {str(k): v for k,v in groups.items()}
+            self.group_index = (groups, index)
+        return self.group_index[1]
+
     def plot_counties(self):
         """plot county borders"""
 
         ax = self.plotview.ax
-        self.counties.plot(color='none', edgecolor='gray',
-                           lw=0.6,alpha=0.7,
-                           ax=ax)
-        return
+        #segments are made once, the collection is made for each new axes
+        lc = self.counties_artist
+        if lc is not None and lc.axes is ax:
+            return lc
+        lc = LineCollection(self.county_lines, colors='gray', lw=0.6, alpha=0.7)
+        ax.add_collection(lc)
+        self.counties_artist = lc
+        return lc
 
     def selection_from_table(self):
         """Plot points from table selection"""
@@ -1716,7 +2060,7 @@ class App(QMainWindow):
         curr = self.sub
         xmin,xmax,ymin,ymax = self.plotview.get_plot_lims()
         df = self.meta_table.model.df
-        found = df.cx[xmin:xmax, ymin:ymax]
+        found = tools.get_in_region(df, xmin, xmax, ymin, ymax)
         reply = QMessageBox.question(self, 'Add to selection?',
                                 "Add to current selection?",
                                  QMessageBox.Cancel | QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
@@ -1738,7 +2082,11 @@ class App(QMainWindow):
         """Plot farm(s)"""
 
         df = self.meta_table.model.df
-        self.sub = df[df.HERD_NO.isin(herd_no)]
+        #rows of each herd are kept from the first lookup
+        index = tools.get_group_index(df, 'HERD_NO')
+        rows = [index[h] for h in set(herd_no) if h in index]
+        rows = np.sort(np.concatenate(rows)) if len(rows) > 0 else []
+        self.sub = df.iloc[rows]
         self.title = '(herd selection) %s' %' '.join(list(herd_no))
         self.parcelsb.setChecked(True)
         self.update()
@@ -1789,16 +2137,19 @@ class App(QMainWindow):
         self.update()
         return
 
-    def set_bounds(self, gdf=None, margin=10):
-        """Set bounds of plot using geodataframe"""
+    def set_bounds(self, gdf=None, margin=10, redraw=True, bounds=None):
+        """Set bounds of plot using geodataframe or precomputed bounds"""
 
-        if gdf is None or len(gdf)==0:
-            return
+        if bounds is None:
+            if gdf is None or len(gdf)==0:
+                return
+            bounds = gdf.total_bounds
         ax = self.plotview.ax
-        minx, miny, maxx, maxy = gdf.total_bounds
+        minx, miny, maxx, maxy = bounds
         ax.set_xlim(minx-margin,maxx+margin)
         ax.set_ylim(miny-margin,maxy+margin)
-        self.plotview.redraw()
+        if redraw == True:
+            self.plotview.redraw()
         return
 
     def show_moves_timeline(self, df, herdcolors, order=None):
@@ -1820,7 +2171,7 @@ class App(QMainWindow):
         aln = MultipleSeqAlignment(self.aln)
         print ('calculating distance matrix for %s sequences..' %len(aln))
 
-        def func(progress_callback):
+        def func():
             self.snpdist = tools.snp_dist_matrix(aln, threads=core.THREADS)
         self.run_threaded_process(func, self.processing_completed)
         return
@@ -1892,7 +2243,12 @@ class App(QMainWindow):
         idx = list(self.sub.index)
         M = self.snpdist.loc[idx,idx]
 
-        w = QWebEngineView()
+        #reuse the open view, a new web view starts another renderer
+        w = None
+        if 'snpdist' in self.docks:
+            w = self.docks['snpdist'].widget()
+        if not isinstance(w, QWebEngineView):
+            w = QWebEngineView()
         css = {'props': 'font-style: monospace; font-weight:normal; font-size: 10px'}
         s = (M.style.background_gradient(cmap='GnBu')
             .set_table_styles([{'selector': 'th', 'props': [('font-size', '7pt')]}])
@@ -1909,7 +2265,6 @@ class App(QMainWindow):
         df = self.meta_table.model.df
         ocols = tools.get_ordinal_columns(df)
         opts = {'column':{'type':'combobox','default':'snp50','items':ocols},
-                'function':{'type':'combobox','default':'sum','items':['sum']},
                 'bins':{'type':'entry','default':10}
                 }
         dlg = widgets.MultipleInputDialog(self, opts, title='Select Options',
@@ -1921,13 +2276,12 @@ class App(QMainWindow):
         kwds = dlg.values
         col = kwds['column']
         bins = int(kwds['bins'])
-        func = kwds['function']
         cmap = self.cmapw.currentText()
         ax = self.plotview.ax
         #self.update()
         #self.plotview.clear()
         #self.plot_counties()
-        plot_hex_grid(self.sub,col,n_cells=bins,aggfunc=func,ax=ax)
+        plotting.plot_top_category_in_grid(self.sub, col, n_cells=bins, cmap=cmap, ax=ax)
         self.plotview.redraw()
         return
 
@@ -1974,6 +2328,48 @@ class App(QMainWindow):
         self.scratchpad.activateWindow()
         return
 
+    def snapshot_figure(self):
+        """
+        Draw the current view on a new figure from the data and options
+        used for it. Returns None if nothing has been plotted.
+        """
+
+        if self.view_data is None:
+            return
+        data, opts = self.view_data
+        fig = self.plotview.fig
+        lims = self.plotview.get_plot_lims()
+        snap = Figure(figsize=fig.get_size_inches(), dpi=fig.dpi)
+        ax = snap.add_subplot(111)
+        snap.patch.set_facecolor(core.FACECOLOR)
+        ax.set_facecolor(core.FACECOLOR)
+        if self.showcountiesb.isChecked():
+            ax.add_collection(LineCollection(self.county_lines, colors='gray', lw=0.6, alpha=0.7))
+        parcels = data['parcels']
+        if self.parcelsb.isChecked() and parcels is not None:
+            plot_parcels(parcels, col=opts['colorparcelscol'], cmap=opts['cmap'], ax=ax)
+            if self.neighbours is not None:
+                self.neighbours.plot(color=self.neighbours.color,alpha=0.4,ax=ax)
+        sub = data['sub'].copy()
+        plotting.plot_selection(sub, col=opts['colorcol'], ms=self.markersizew.value(),
+                                cmap=opts['cmap'], legend=self.legendb.isChecked(),
+                                bounds=data['bounds'], ax=ax)
+        if self.movesb.isChecked() and data['moves'] is not None:
+            plot_moves(data['moves'], self.lpis_cent, ax=ax)
+        if self.title != None:
+            snap.suptitle(self.title)
+        snap.tight_layout()
+        ax.set_xlim(lims[0],lims[1])
+        ax.set_ylim(lims[2],lims[3])
+        provider = self.mapproviderw.currentText()
+        if provider != '':
+            #only a basemap that is already cached, no download here
+            image = plotting.get_context_map(provider, *lims, fetch=False)
+            if image is not None:
+                plotting.add_context_map(ax, provider, image=image)
+        show_labels(sub, self.labelsw.currentText(), ax)
+        return snap
+
     def save_to_scratchpad(self, label=None):
         """Save plot to scratchpad"""
 
@@ -1984,11 +2380,11 @@ class App(QMainWindow):
 
         idx = self.tabs.currentIndex()
         if idx == 0:
-            #get the current figure and make a copy of it by using pickle
-            fig = self.plotview.fig
-            p = pickle.dumps(fig)
-            fig = pickle.loads(p)
-            self.scratch_items[label] = fig
+            #draw the view again on a new figure rather than copying the figure
+            snap = self.snapshot_figure()
+            if snap is None:
+                return
+            self.scratch_items[label] = snap
             if hasattr(self, 'scratchpad'):
                 self.scratchpad.update(self.scratch_items)
         elif idx == 1:
@@ -2204,9 +2600,14 @@ class App(QMainWindow):
     def show_browser_tab(self, link, name):
         """Show browser"""
 
-        browser = QWebEngineView()
+        #show in the tab of the same name if it is already open
+        idx = self.get_tab_names().get(name)
+        if idx is not None and isinstance(self.tabs.widget(idx), QWebEngineView):
+            browser = self.tabs.widget(idx)
+        else:
+            browser = QWebEngineView()
+            idx = self.tabs.addTab(browser, name)
         browser.setUrl(QUrl(link))
-        idx = self.tabs.addTab(browser, name)
         self.tabs.setCurrentIndex(idx)
         return
 
@@ -2247,7 +2648,8 @@ class App(QMainWindow):
                 event.ignore()
                 return
             elif reply == QMessageBox.Yes:
-                self.save_project()
+                #app is closing so don't leave this to a thread
+                self.save_project(threaded=False)
         self.save_settings()
         event.accept()
         return
@@ -2271,7 +2673,6 @@ class App(QMainWindow):
             VERSION = core.git_version()
         except:
             from . import __version__ as VERSION
-        import matplotlib
         try:
             import PySide2
             pyqtver = 'PySide2 v'+PySide2.QtCore.__version__
@@ -2280,7 +2681,7 @@ class App(QMainWindow):
             pyqtver = 'PyQt5 v'+PYQT_VERSION_STR
         pandasver = pd.__version__
         pythonver = platform.python_version()
-        mplver = matplotlib.__version__
+        mplver = mpl.__version__
         gpdver = gpd.__version__
         text='TracebTB\n'\
             +'version '+VERSION+'\n'\
@@ -2291,7 +2692,7 @@ class App(QMainWindow):
             +'version 3 of the License, or (at your option) any '\
             +'later version.\n'\
             +'Using Python v%s, %s\n' %(pythonver, pyqtver)\
-            +'pandas v%s, matplotlib v%s' %(pandasver,mplver)\
+            +'pandas v%s, matplotlib v%s, ' %(pandasver,mplver)\
             +'geopandas v%s' %gpdver
 
         msg = QMessageBox.about(self, "About", text)
@@ -2305,18 +2706,36 @@ class StdoutRedirect(QObject):
         self.daemon = True
         self.sysstdout = sys.stdout.write
         self.sysstderr = sys.stderr.write
+        self.sysflush = sys.stdout.flush
+        self.buffers = {}
 
     def stop(self):
+        self.flush()
         sys.stdout.write = self.sysstdout
         sys.stderr.write = self.sysstderr
+        sys.stdout.flush = self.sysflush
 
     def start(self):
         sys.stdout.write = self.write
         sys.stderr.write = lambda msg : self.write(msg, color="red")
+        sys.stdout.flush = self.flush
 
     def write(self, s, color="black"):
-        sys.stdout.flush()
-        self.printOccur.emit(s, color)
+        #print calls write several times per line so only emit whole lines
+        buf = self.buffers.setdefault(color, [])
+        buf.append(s)
+        if '\n' in s:
+            self.printOccur.emit(''.join(buf), color)
+            buf.clear()
+
+    def flush(self):
+        """Emit any text still waiting for a newline"""
+
+        for color, buf in self.buffers.items():
+            if len(buf) > 0:
+                self.printOccur.emit(''.join(buf), color)
+                buf.clear()
+        return
 
 class AppOptions(widgets.BaseOptions):
     """Class to provide a dialog for global plot options"""
@@ -2325,7 +2744,7 @@ class AppOptions(widgets.BaseOptions):
         """Setup variables"""
         self.parent = parent
         self.kwds = {}
-        cpus = os.cpu_count()
+        cpus = core.get_cpu_count()
         self.groups = {'general':['threads','labelsep','overwrite'],
                        }
         self.opts = {'threads':{'type':'spinbox','default':4,'range':(1,cpus)},
@@ -20,6 +20,9 @@
 
 import os, sys, io, random, subprocess, time
 import string, math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 pd.set_option('display.width', 200)
@@ -28,8 +31,17 @@ import pylab as plt
 import matplotlib as mpl
 import matplotlib.colors as colors
 import geopandas as gpd
+from shapely.geometry import box
 from . import tools, core
-from matplotlib_scalebar.scalebar import ScaleBar
+
+#decoded basemap tiles keyed by (z,x,y,provider)
+tile_cache = OrderedDict()
+tile_cache_size = 512
+tile_lock = threading.Lock()
+tile_session = None
+#basemaps already warped to the map crs
+basemap_cache = OrderedDict()
+basemap_cache_size = 8
 
 def make_legend(fig, colormap, loc='best', title='',fontsize=12):
     """Make a figure legend wth provided color mapping"""
@@ -87,7 +99,7 @@ def gen_colors(cmap,n,reverse=False):
     see also https://matplotlib.org/stable/tutorials/colors/colormaps.html
     '''
 
-    c_map = plt.cm.get_cmap(str(cmap)) # select the desired cmap
+    c_map = mpl.colormaps[str(cmap)] # select the desired cmap
     arr=np.linspace(0,1,n) #create a list with numbers from 0 to 1 with n items
     colorlist=list()
     for c in arr:
@@ -114,16 +126,18 @@ def get_color_mapping(df, col, cmap=None, seed=1):
     if cmap == None:
         rcolors = random_colors(len(c),seed)
     else:
-        cmap = mpl.cm.get_cmap(cmap)
+        cmap = mpl.colormaps[cmap]
         rcolors = [cmap(i) for i in range(len(c))]
     colormap = dict(zip(c, rcolors))
     newcolors =  [colormap[i] if i in colormap else 'Black' for i in df[col]]
     return newcolors, colormap
 
 def plot_selection(df, col=None, cmap=None, color=None, margin=None, ms=40,
-                   alpha=0.7, edgecolor=None, legend=False, title='', ax=None):
-    """Plot a single map view of a set of points/farms"""
+                   alpha=0.7, edgecolor=None, legend=False, title='', bounds=None, ax=None):
+    """Plot a single map view of a set of points/farms.
+    bounds of the non-empty points can be given if already known."""
 
+    from matplotlib_scalebar.scalebar import ScaleBar
     if ax == None:
         fig,ax=plt.subplots(1,1)
     df = df[~df.is_empty]
@@ -135,7 +149,9 @@ def plot_selection(df, col=None, cmap=None, color=None, margin=None, ms=40,
         ax.axis('off')
         return
 
-    minx, miny, maxx, maxy = df.total_bounds
+    if bounds is None:
+        bounds = df.total_bounds
+    minx, miny, maxx, maxy = bounds
     if len(df) == 1:
         minx -= 1000
         miny -= 1000
@@ -154,22 +170,36 @@ def plot_selection(df, col=None, cmap=None, color=None, margin=None, ms=40,
     #color argmument overrides others
     if color != None:
         df['color'] = color
-    ncols = 1
-    if col in df.columns and len(df.groupby(col).groups) > 15:
-        ncols = 2
-    legfmt = {'title': col, 'fontsize': 'small', 'frameon': False, 'draggable': True, 'ncol': ncols}
-
-    # Split the dataframe by species
-    cows = df[df.Species == 'Bovine']
-    badgers = df[df.Species == 'Badger']
-    if not cows.empty:
-        cows.plot(color=cows.color, ax=ax, alpha=alpha, markersize=ms,
-                    edgecolor=edgecolor, linewidth=.5,
-                      legend=legend, legend_kwds=legfmt)
-    if not badgers.empty:
+
+    #one scatter per species drawn from plain arrays
+    species = df.Species.to_numpy()
+    x = df.geometry.x.to_numpy()
+    y = df.geometry.y.to_numpy()
+    colors = df.color.to_numpy()
+    cows = species == 'Bovine'
+    badgers = species == 'Badger'
+    if cows.any():
+        ax.scatter(x[cows], y[cows], color=colors[cows], alpha=alpha, s=ms,
+                   edgecolor=edgecolor, linewidth=.5, label='Bovine')
+    if badgers.any():
         if col is None or col == '':
-            badgers.plot(color=badgers.color, ax=ax, alpha=alpha, edgecolor=edgecolor,
-                         marker='s', markersize=ms, linewidth=.5)
+            ax.scatter(x[badgers], y[badgers], color=colors[badgers], alpha=alpha,
+                       edgecolor=edgecolor, marker='s', s=ms, linewidth=.5, label='Badger')
+
+    if legend == True:
+        if col in df.columns:
+            #one entry per value of col with the color used for it
+            import matplotlib.lines as mlines
+            cats = df.drop_duplicates(col).sort_values(col)
+            handles = [mlines.Line2D([], [], marker='o', linestyle='', color=c, label=str(v))
+                        for v,c in zip(cats[col], cats.color)]
+            ncols = 1
+            if len(handles) > 15:
+                ncols = 2
+            ax.legend(handles=handles, title=col, fontsize='small', frameon=False,
+                      draggable=True, ncol=ncols)
+        else:
+            ax.legend(fontsize='small', frameon=False, draggable=True)
     ax.set_title(title)
     ax.axis('off')
 
@@ -180,6 +210,155 @@ def plot_selection(df, col=None, cmap=None, color=None, margin=None, ms=40,
     ax.add_artist(ScaleBar(dx=1, location=3))
     return ax
 
+def get_tile_session():
+    """Shared http session so tile requests reuse connections"""
+
+    global tile_session
+    if tile_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        tile_session = requests.Session()
+        tile_session.headers['User-Agent'] = 'tracebtb'
+        adapter = HTTPAdapter(pool_maxsize=16, max_retries=Retry(total=5, backoff_factor=0.1))
+        tile_session.mount('http://', adapter)
+        tile_session.mount('https://', adapter)
+    return tile_session
+
+def fetch_tile(source, z, x, y):
+    """Get a single decoded tile as an RGB array. Kept in memory for reuse."""
+
+    key = (z, x, y, source.name)
+    with tile_lock:
+        if key in tile_cache:
+            tile_cache.move_to_end(key)
+            return tile_cache[key]
+    from PIL import Image
+    r = get_tile_session().get(source.build_url(x=x, y=y, z=z), timeout=10)
+    r.raise_for_status()
+    img = np.asarray(Image.open(io.BytesIO(r.content)).convert('RGB'))
+    with tile_lock:
+        tile_cache[key] = img
+        if len(tile_cache) > tile_cache_size:
+            tile_cache.popitem(last=False)
+    return img
+
+def get_tile_zoom(w, s, e, n, max_zoom=19):
+    """Zoom level for a lon/lat box, as used by contextily"""
+
+    zoom_lon = np.ceil(np.log2(360 * 2.0 / (e - w)))
+    zoom_lat = np.ceil(np.log2(360 * 2.0 / (n - s)))
+    return int(min(zoom_lon, zoom_lat, max_zoom))
+
+def get_basemap(source, w, s, e, n, threads=4):
+    """
+    Mosaic of tiles covering a lon/lat box.
+    Returns:
+        image array and extent (left, right, bottom, top) in EPSG:3857
+    """
+
+    import mercantile
+    zoom = get_tile_zoom(w, s, e, n, source.get('max_zoom', 19))
+    tiles = list(mercantile.tiles(w, s, e, n, zooms=zoom))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        imgs = list(executor.map(lambda t: fetch_tile(source, t.z, t.x, t.y), tiles))
+    xs = sorted(set(t.x for t in tiles))
+    ys = sorted(set(t.y for t in tiles))
+    th, tw = imgs[0].shape[:2]
+    img = np.zeros((len(ys)*th, len(xs)*tw, 3), dtype=np.uint8)
+    for t,tile in zip(tiles, imgs):
+        i = ys.index(t.y)
+        j = xs.index(t.x)
+        img[i*th:(i+1)*th, j*tw:(j+1)*tw] = tile
+    ul = mercantile.xy_bounds(xs[0], ys[0], zoom)
+    lr = mercantile.xy_bounds(xs[-1], ys[-1], zoom)
+    extent = (ul.left, lr.right, lr.bottom, ul.top)
+    return img, extent
+
+def get_warped_basemap(source, w, s, e, n, crs, threads=4):
+    """
+    Basemap for a lon/lat box warped to crs. Warped images are cached by
+    the set of tiles they cover, so redraws of the same area skip both the
+    mosaic and the reprojection.
+    """
+
+    import mercantile
+    import contextily as cx
+    zoom = get_tile_zoom(w, s, e, n, source.get('max_zoom', 19))
+    tiles = list(mercantile.tiles(w, s, e, n, zooms=zoom))
+    xs = [t.x for t in tiles]
+    ys = [t.y for t in tiles]
+    key = (source.name, zoom, min(xs), min(ys), max(xs), max(ys), str(crs))
+    with tile_lock:
+        if key in basemap_cache:
+            basemap_cache.move_to_end(key)
+            return basemap_cache[key]
+    img, ext = get_basemap(source, w, s, e, n, threads)
+    img, ext = cx.warp_tiles(img, ext, t_crs=crs)
+    with tile_lock:
+        basemap_cache[key] = (img, ext)
+        if len(basemap_cache) > basemap_cache_size:
+            basemap_cache.popitem(last=False)
+    return img, ext
+
+def get_context_map(provider, xmin, xmax, ymin, ymax, crs='EPSG:29902', threads=4,
+                    fetch=True):
+    """
+    Basemap image and extent for a view in crs. Tiles are fetched in
+    parallel and cached in memory so that redraws after panning or zooming
+    only download new tiles. The warped image is also kept for redraws of
+    the same area. Safe to call from a thread.
+    Args:
+        provider: tile provider name e.g. 'OpenStreetMap Mapnik'
+        crs: crs of the view
+        threads: number of parallel tile downloads
+        fetch: if False only return an image already cached, or None
+    """
+
+    #same view as a previous call, skip the reprojection and tile lookup
+    key = (provider, round(xmin), round(xmax), round(ymin), round(ymax), str(crs))
+    with tile_lock:
+        found = basemap_cache.get(key)
+        if found is not None:
+            basemap_cache.move_to_end(key)
+    if found is not None or fetch == False:
+        return found
+    import contextily as cx
+    source = cx.providers.query_name(provider)
+    if 'openstreetmap' in source.url:
+        #osm tile usage policy only allows 2 connections
+        threads = min(threads, 2)
+    view = gpd.GeoSeries([box(xmin,ymin,xmax,ymax)], crs=crs).to_crs('EPSG:4326')
+    w,s,e,n = view.total_bounds
+    img, ext = get_warped_basemap(source, w, s, e, n, crs, threads)
+    with tile_lock:
+        basemap_cache[key] = (img, ext)
+        if len(basemap_cache) > basemap_cache_size:
+            basemap_cache.popitem(last=False)
+    return img, ext
+
+def add_context_map(ax, provider='CartoDB Positron', crs='EPSG:29902', threads=4,
+                    image=None):
+    """
+    Add a basemap of web tiles under the current view of a map axis.
+    Args:
+        ax: axis with data plotted in crs
+        provider: tile provider name e.g. 'OpenStreetMap Mapnik'
+        crs: crs of the plotted data
+        threads: number of parallel tile downloads
+        image: image and extent from get_context_map, fetched if not given
+    """
+
+    xmin,xmax = ax.get_xlim()
+    ymin,ymax = ax.get_ylim()
+    if image is None:
+        image = get_context_map(provider, xmin, xmax, ymin, ymax, crs, threads)
+    img, ext = image
+    im = ax.imshow(img, extent=ext, interpolation='bilinear', zorder=0)
+    ax.set_xlim(xmin,xmax)
+    ax.set_ylim(ymin,ymax)
+    return im
+
 def zoom_to_bounds(gdf,ax, margin=None):
     """Zoom to bounds of gdf"""
 
@@ -220,6 +399,7 @@ def calculate_grid_dimensions(n):
     Plot herds on multiple axes. Useful for overview of farms and reports.
     """
 
+    from matplotlib_scalebar.scalebar import ScaleBar
     groups = gdf.groupby('HERD_NO')
     n = len(groups)+1
     rows, cols = calculate_grid_dimensions(n)
@@ -291,21 +471,25 @@ def plot_top_category_in_grid(gdf, col, n_cells=10, cmap='viridis', ax=None):
     """
 
     grid = tools.create_hex_grid(gdf, n_cells=n_cells)
-    merged = gpd.sjoin(gdf, grid, how='left', predicate='within')
-
-    # Compute the top category per grid cell
-    def aggtop(x):
-        """Return the most common category in a group."""
-        c = x.value_counts()
-        if len(c) > 0:
-            return c.index[0]
-        return None
-
-    dissolve = merged.dissolve(by="index_right", aggfunc={col: aggtop})
-    clrs,cm = tools.get_color_mapping(gdf, col, cmap=cmap)
+    #categorical column so values are hashed once and compared as int codes
+    gdf = gdf[gdf[col].notnull()].copy()
+    gdf[col] = gdf[col].astype('category')
+    #point in polygon query on the grid index, no merged frame needed
+    pts, cellpos = grid.sindex.query(gdf.geometry.values, predicate='within')
+
+    #top category per grid cell: count codes per cell with one bincount
+    #and take the largest, no per group python calls or dissolve
+    cats = gdf[col].cat.categories
+    cells, cellidx = np.unique(grid.index.to_numpy()[cellpos], return_inverse=True)
+    codes = gdf[col].cat.codes.to_numpy()[pts]
+    counts = np.bincount(cellidx*len(cats) + codes, minlength=len(cells)*len(cats))
+    top = counts.reshape(len(cells), len(cats)).argmax(axis=1)
+    #colors for the categories only, no need to map every row
+    cmap = mpl.colormaps[cmap]
+    cm = dict(zip(cats, [cmap(i) for i in range(len(cats))]))
     grid['value'] = None
     grid['color'] = None
-    grid.loc[dissolve.index, 'value'] = dissolve[col].values
+    grid.loc[cells, 'value'] = cats[top]
     grid['color'] = grid['value'].map(cm)
 
     # Plot the grid with colors representing the top category
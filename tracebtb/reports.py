@@ -58,9 +58,7 @@ def cluster_report(sub, parcels, lpis_cent, moves=None, treefile=None,
     gui.plot_single_cluster(sub,col=colorcol,cmap=cmap,ax=ax)
     gui.show_labels(sub, labelcol, ax)
     if basemap == True:
-        import contextily as cx
-        cx.add_basemap(ax, crs=cent.crs,
-                attribution=False, source=gui.providers['OSM'])
+        plotting.add_context_map(ax, 'OpenStreetMap Mapnik', crs=sub.crs)
 
     plt.tight_layout()
     tempname = tempfile.mktemp()
@@ -29,9 +29,6 @@ import string
 from .qt import *
 from . import core, tools, widgets, tables
 import geopandas as gpd
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-from Bio import SeqIO, AlignIO
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
@@ -42,7 +39,7 @@ except AttributeError:
 module_path = os.path.dirname(os.path.abspath(__file__))
 iconpath = os.path.join(module_path, 'icons')
 data_path = os.path.join(module_path,'data')
-borders = gpd.read_file(os.path.join(data_path,'counties.shp'))
+borders = gpd.read_file(os.path.join(data_path,'counties.shp'), engine='pyogrio', use_arrow=True)
 logoimg = os.path.join(iconpath, 'simulate.svg')
 bounds = [230000,230000,250000,250000]
 
@@ -307,11 +304,16 @@ class SimulateApp(QMainWindow):
         def func(progress_callback):
             print (self.model)
             self.set_status('running..')
+            last = -1
             for s in range(steps):
                 if self.running == False:
                     break
                 model.step()
-                progress_callback.emit(s/steps)
+                #only signal when the percentage shown changes
+                pct = int(s/steps*100)
+                if pct != last:
+                    progress_callback.emit(s/steps)
+                    last = pct
                 ax = self.gridview.ax
                 ax.clear()
                 btbabm.plot_grid(model,ax=ax,pos=model.pos,colorby='strain',ns='num_infected')
@@ -339,6 +341,7 @@ class SimulateApp(QMainWindow):
         #dist matrix
         snpdist.to_csv(os.path.join(self.path,'snpdist.csv'))
         #alignment
+        from Bio import AlignIO
         AlignIO.write(model.aln,os.path.join(self.path,'aln.fasta'),'fasta')
         #parcels
         model.parcels.to_file(os.path.join(self.path, 'parcels.shp'))
@@ -358,10 +361,10 @@ class SimulateApp(QMainWindow):
     def run_threaded_process(self, process, on_complete):
         """Execute a function in the background with a worker"""
 
-        worker = widgets.Worker(fn=process)
-        self.threadpool.start(worker)
+        worker = widgets.Worker(fn=process, report_progress=True)
         worker.signals.finished.connect(on_complete)
         worker.signals.progress.connect(self.progress_fn)
+        self.threadpool.start(worker)
         return
 
     def processing_completed(self):
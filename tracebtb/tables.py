@@ -25,7 +25,7 @@ import pandas as pd
 import numpy as np
 import pylab as plt
 from .qt import *
-from . import core, widgets, plotting
+from . import core, widgets, plotting, tools
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
 
 style = '''
@@ -49,6 +49,33 @@ style = '''
     }
     '''
 
+def format_value(value):
+    """Display value for a cell of any type"""
+
+    if type(value) != str:
+        if type(value) in [float,np.float64] and np.isnan(value):
+            return ''
+        elif type(value) == float:
+            return value
+        else:
+            return (str(value))
+    else:
+        return '{0}'.format(value)
+
+def format_float(value):
+    """Display value for a float cell"""
+
+    if np.isnan(value):
+        return ''
+    return str(value)
+
+def format_date(value):
+    """Display value for a date cell"""
+
+    if value is pd.NaT:
+        return ''
+    return value.strftime(core.TIMEFORMAT)
+
 class ColumnHeader(QHeaderView):
     def __init__(self):
         super(QHeaderView, self).__init__()
@@ -161,12 +188,12 @@ class DataFrameWidget(QWidget):
     def copy(self):
         """Copy to clipboard"""
 
-        #check size of dataframe
-        m = self.table.model.df.memory_usage(deep=True).sum()
+        #check size of dataframe, a shallow count is enough for this
+        m = self.table.model.df.memory_usage(deep=False, index=True).sum()
         if m>1e8:
             answer = QMessageBox.question(self, 'Copy?',
                              'This data may be too large to copy. Are you sure?', QMessageBox.Yes, QMessageBox.No)
-            if not answer:
+            if answer == QMessageBox.No:
                 return
         df = self.table.getSelectedDataFrame()
         df.to_clipboard()
@@ -229,6 +256,43 @@ class HeaderView(QHeaderView):
         self.setSectionsClickable(True)
         self.setSelectionBehavior(QTableView.SelectColumns)
         self.setStretchLastSection(False)
+        #text heights and the header height are kept between layouts
+        self.heights = {}
+        self.max_height = None
+        self.sectionResized.connect(self.clearHeight)
+        self.metrics = QFontMetrics(self.font())
+        return
+
+    def setModel(self, model):
+        """Clear stored sizes whenever the headers of the model change"""
+
+        QHeaderView.setModel(self, model)
+        self.clearSizes()
+        if model is None:
+            return
+        model.modelReset.connect(self.clearSizes)
+        model.layoutChanged.connect(self.clearHeight)
+        model.headerDataChanged.connect(self.clearSizes)
+        model.columnsInserted.connect(self.clearHeight)
+        model.columnsRemoved.connect(self.clearHeight)
+        return
+
+    def clearHeight(self, *args):
+        self.max_height = None
+        return
+
+    def clearSizes(self, *args):
+        self.heights = {}
+        self.max_height = None
+        return
+
+    def changeEvent(self, event):
+        """Text sizes change with the font"""
+
+        if event.type() == QtCore.QEvent.FontChange:
+            self.metrics = QFontMetrics(self.font())
+            self.clearSizes()
+        QHeaderView.changeEvent(self, event)
         return
 
     def sectionSizeFromContents(self, logicalIndex):
@@ -236,17 +300,22 @@ class HeaderView(QHeaderView):
 
         text = self.model().headerData(logicalIndex, self.orientation(), QtCore.Qt.DisplayRole)
         alignment = self.defaultAlignment()
-        metrics = QFontMetrics(self.fontMetrics())
+        metrics = self.metrics
         width = metrics.boundingRect(QtCore.QRect(), alignment, text).width()
 
-        heights = []
-        for i in range(self.count()):
-            text = self.model().headerData(i, self.orientation(),QtCore.Qt.DisplayRole)
-            size = self.sectionSize(i)
-            rect = QtCore.QRect(0, 0, size, self.MAX_HEIGHT)
-            heights.append(metrics.boundingRect(rect, alignment, text).height())
-        height = sorted(heights)[-1] + 5
-        return QtCore.QSize(width, height)
+        #height fits the tallest header, only found again when sections change
+        if self.max_height is None:
+            heights = []
+            for i in range(self.count()):
+                text = self.model().headerData(i, self.orientation(),QtCore.Qt.DisplayRole)
+                size = self.sectionSize(i)
+                key = (text, size)
+                if key not in self.heights:
+                    rect = QtCore.QRect(0, 0, size, self.MAX_HEIGHT)
+                    self.heights[key] = metrics.boundingRect(rect, alignment, text).height()
+                heights.append(self.heights[key])
+            self.max_height = sorted(heights)[-1] + 5
+        return QtCore.QSize(width, self.max_height)
 
 class DataFrameTable(QTableView):
     """
@@ -412,14 +481,17 @@ class DataFrameTable(QTableView):
     def getSelectedRows(self):
         """Get selected rows. Uses proxy index."""
 
+        #read the selected ranges rather than one index per selected cell
         sm = self.selectionModel()
-        rows = []
-        for proxy_index in sm.selectedIndexes():
-            source_index = self.proxy.mapToSource(proxy_index)
-            rows.append(source_index.row())
-        # Remove duplicates and return unique rows
-        rows = list(set(rows))
-        return rows
+        model = sm.model()
+        rows = set()
+        for r in sm.selection():
+            for i in range(r.top(), r.bottom()+1):
+                if model is self.proxy:
+                    i = self.proxy.mapToSource(model.index(i, 0)).row()
+                rows.add(i)
+        #unique rows in table order
+        return sorted(rows)
 
     def getSelectedIndexes(self):
         """Get selected row indexes"""
@@ -432,22 +504,16 @@ class DataFrameTable(QTableView):
         """Get selected column indexes"""
 
         sm = self.selectionModel()
-        cols = [(i.column()) for i in sm.selectedIndexes()]
-        cols = list(dict.fromkeys(cols).keys())
-        return cols
+        cols = {i for r in sm.selection() for i in range(r.left(), r.right()+1)}
+        return sorted(cols)
 
     def getSelectedDataFrame(self):
         """Get selection as a dataframe"""
 
         df = self.model.df
-        sm = self.selectionModel()
-
         rows = self.getSelectedRows()
         #rows = [(i.row()) for i in sm.selectedIndexes()]
-        cols = [(i.column()) for i in sm.selectedIndexes()]
-        #get unique rows/cols keeping order
-        #rows = list(dict.fromkeys(rows).keys())
-        cols = list(dict.fromkeys(cols).keys())
+        cols = self.getSelectedColumns()
         return df.iloc[rows,cols]
 
     def setSelected(self, rows, cols):
@@ -459,11 +525,27 @@ class DataFrameTable(QTableView):
         #print (rows,cols)
         if len(rows)==0 or len(cols)==0:
             return
-        topleft = self.model.index(rows[0], cols[0])
-        bottomright = self.model.index(rows[-1], cols[-1])
-        selection = QtCore.QItemSelection(topleft, bottomright)
+        sm = self.selectionModel()
+        model = sm.model()
+        #rows are positions in the dataframe, find them in the view
+        if model is self.proxy:
+            rows = [self.proxy.mapFromSource(self.model.index(i, 0)).row() for i in rows]
+        rows = np.unique(rows)
+        cols = np.unique(cols)
+        rows = rows[rows >= 0]
+        if len(rows) == 0:
+            return
+        #one range per block of adjacent rows and columns, selected in one call
+        rowruns = np.split(rows, np.where(np.diff(rows) != 1)[0] + 1)
+        colruns = np.split(cols, np.where(np.diff(cols) != 1)[0] + 1)
+        selection = QtCore.QItemSelection()
+        for r in rowruns:
+            for c in colruns:
+                topleft = model.index(int(r[0]), int(c[0]))
+                bottomright = model.index(int(r[-1]), int(c[-1]))
+                selection.append(QtCore.QItemSelectionRange(topleft, bottomright))
         mode = QtCore.QItemSelectionModel.Select
-        self.selectionModel().select(selection, mode)
+        sm.select(selection, mode)
         return
 
     def getScrollPosition(self):
@@ -510,6 +592,7 @@ class DataFrameTable(QTableView):
         self.storeCurrent()
         #print (rows, cols)
         self.model.df.iloc[rows,cols] = np.nan
+        self.model.clearCache()
         return
 
     def editCell(self, item):
@@ -728,7 +811,51 @@ class DataFrameTable(QTableView):
                              'Are you sure?', QMessageBox.Yes, QMessageBox.No)
         if reply == QMessageBox.No:
             return False
-        self.model.df = self.model.df.drop(columns=[column])
+        self.removeColumn(column)
+        return
+
+    def removeColumn(self, column):
+        """
+        Remove a column from the table in place. Only the column is removed
+        from the view rather than resetting the whole model. A new frame is
+        made instead if the model's frame is shared, e.g. the current selection.
+        """
+
+        model = self.model
+        df = model.df
+        j = df.columns.get_loc(column)
+        if not isinstance(j, int):
+            #repeated column names
+            model.df = df.drop(columns=[column])
+            self.refresh()
+            return
+        model.beginRemoveColumns(QtCore.QModelIndex(), j, j)
+        if model.shared == True:
+            model.df = df.drop(columns=[column])
+        else:
+            del df[column]
+            tools.clear_lookups(df)
+            model.dropCachedColumn(j)
+        model.endRemoveColumns()
+        if hasattr(self.parent,'statusbar'):
+            self.parent.updateStatusBar()
+        return
+
+    def removeRows(self, rows):
+        """
+        Remove rows by position, in place unless the frame is shared or
+        has repeated index labels.
+        """
+
+        model = self.model
+        df = model.df
+        if model.shared == False and df.index.is_unique:
+            df.drop(df.index[rows], inplace=True)
+        else:
+            keep = np.ones(len(df), dtype=bool)
+            keep[rows] = False
+            model.df = df[keep]
+        #the reset also clears lookups made from the frame
         self.refresh()
         return
 
@@ -739,9 +866,7 @@ class DataFrameTable(QTableView):
                              'Are you sure?', QMessageBox.Yes, QMessageBox.No)
         if reply == QMessageBox.No:
             return False
-        idx = self.model.df.index[rows]
-        self.model.df = self.model.df.drop(idx)
-        self.refresh()
+        self.removeRows(rows)
         return
 
     def renameColumn(self, column=None):
@@ -805,8 +930,10 @@ class DataFrameTable(QTableView):
         #cols = df.columns[idx]
         #d = df[cols]
         data = self.getSelectedDataFrame()
-        d = data._get_numeric_data()
+        d = data.select_dtypes(include='number')
         #print (d)
+        if len(d.columns) == 0:
+            return
         xcol = d.columns[0]
         ycols = d.columns[1:]
 
@@ -819,7 +946,10 @@ class DataFrameTable(QTableView):
         elif kind == 'hist':
             d.plot(kind='hist',subplots=True,ax=ax)
         elif kind == 'scatter':
-            d=d.dropna()
+            #only rows missing a plotted value are dropped
+            cols = [xcol] + list(ycols)
+            mask = np.isfinite(d[cols].to_numpy(dtype=float)).all(axis=1)
+            d = d.loc[mask, cols]
             d.plot(x=xcol,y=ycols,kind='scatter',ax=ax)
         elif kind == 'pie':
             d.plot(kind='pie',subplots=True,legend=False,ax=ax)
@@ -836,14 +966,21 @@ class DataFrameTable(QTableView):
         #cmap = 'Set1'
         df = self.model.df
         colors,colormap = plotting.get_color_mapping(df,col,seed=10)
-        print (colors)
-        self.model.rowcolors = colors
+        #one QColor per distinct color, shared by the rows
+        qcolors = {c: QColor(c) for c in set(colors)}
+        self.model.rowcolors = [qcolors[c] for c in colors]
+        self.viewport().update()
         return
 
     def getMemory(self):
         """Get memory info as string"""
 
-        m = self.model.df.memory_usage(deep=True).sum()
+        #kept until the table changes, deep counts read every string
+        model = self.model
+        df = model.df
+        if model.memory is None or model.memory[0] is not df or model.memory[1] != df.shape:
+            model.memory = (df, df.shape, df.memory_usage(deep=True).sum())
+        m = model.memory[2]
         if m>1e5:
             m = round(m/1048576,2)
             units='MB'
@@ -853,19 +990,69 @@ class DataFrameTable(QTableView):
         return s
 
 class DataFrameModel(QtCore.QAbstractTableModel):
+    roles = {QtCore.Qt.DisplayRole, QtCore.Qt.EditRole, QtCore.Qt.BackgroundRole}
     def __init__(self, dataframe=None, *args):
         super(DataFrameModel, self).__init__()
         if dataframe is None:
             self.df = pd.DataFrame()
         else:
             self.df = dataframe
-        self.bg = '#F4F4F3'
+        self.bg = QColor('#F4F4F3')
         self.rowcolors = None
+        #set if df is also used elsewhere so it is not changed in place
+        self.shared = False
+        self.clearCache()
+        #any reset of the model may have changed the columns
+        self.modelReset.connect(self.clearCache)
         return
 
     def update(self, df):
         self.df = df
 
+    def clearCache(self):
+        """Clear the stored column values and any lookups made from df"""
+
+        if getattr(self, 'df', None) is not None:
+            tools.clear_lookups(self.df)
+        self.cache_df = None
+        self.cache_shape = None
+        self.colcache = {}
+        self.memory = None
+        return
+
+    def dropCachedColumn(self, j):
+        """Update the stored columns after column j is deleted in place"""
+
+        if self.cache_df is not self.df:
+            return
+        self.colcache = {(k-1 if k > j else k): c for k,c in self.colcache.items() if k != j}
+        self.cache_shape = self.df.shape
+        return
+
+    def getColumn(self, j):
+        """
+        Values of a column as an array and the function to display them.
+        Made when a column is first shown and kept until df changes, so
+        painting a cell does not go through pandas.
+        """
+
+        df = self.df
+        if self.cache_df is not df or self.cache_shape != df.shape:
+            self.cache_df = df
+            self.cache_shape = df.shape
+            self.colcache = {}
+        c = self.colcache.get(j)
+        if c is None:
+            s = df.iloc[:, j]
+            if is_datetime(s.dtype):
+                c = (s.to_numpy(dtype=object), format_date)
+            elif s.dtype == np.float64:
+                c = (s.to_numpy(), format_float)
+            else:
+                c = (s.to_numpy(), format_value)
+            self.colcache[j] = c
+        return c
+
     def rowCount(self, parent=QtCore.QModelIndex()):
         return len(self.df.index)
 
@@ -877,27 +1064,16 @@ class DataFrameModel(QtCore.QAbstractTableModel):
         are edited or what appears in each cell.
         """
 
+        #the view asks for many roles per cell, most are not used here
+        if role not in self.roles:
+            return None
         i = index.row()
         j = index.column()
-        #print (self.df.dtypes)
-        #coltype = self.df.dtypes[j]
-        coltype = self.df[self.df.columns[j]].dtype
-        isdate = is_datetime(coltype)
         if role == QtCore.Qt.DisplayRole:
-            value = self.df.iloc[i, j]
-            if isdate:
-                return value.strftime(core.TIMEFORMAT)
-            elif type(value) != str:
-                if type(value) in [float,np.float64] and np.isnan(value):
-                    return ''
-                elif type(value) == float:
-                    return value
-                else:
-                    return (str(value))
-            else:
-                return '{0}'.format(value)
+            values, fmt = self.getColumn(j)
+            return fmt(values[i])
         elif (role == QtCore.Qt.EditRole):
-            value = self.df.iloc[i, j]
+            value = self.getColumn(j)[0][i]
             if type(value) is str:
                 try:
                     return float(value)
@@ -906,12 +1082,10 @@ class DataFrameModel(QtCore.QAbstractTableModel):
             if np.isnan(value):
                 return ''
         elif role == QtCore.Qt.BackgroundRole:
-            if self.rowcolors != None:
-                clr = self.rowcolors[i]
-                #print (clr)
-                return QColor(clr)
+            if self.rowcolors is not None:
+                return self.rowcolors[i]
             else:
-                return QColor(self.bg)
+                return self.bg
 
     def headerData(self, col, orientation, role=QtCore.Qt.DisplayRole):
         """What's displayed in the headers"""
@@ -936,11 +1110,19 @@ class DataFrameModel(QtCore.QAbstractTableModel):
     def sort(self, idx, ascending=True):
         """Sort table by given column number """
 
-        self.layoutAboutToBeChanged.emit()
         if len(self.df.columns) == 0:
             return
-        col = self.df.columns[idx]
-        self.df = self.df.sort_values(col, ascending=ascending)
+        self.layoutAboutToBeChanged.emit()
+        #old row positions in sorted order
+        s = self.df.iloc[:, idx].reset_index(drop=True)
+        order = s.sort_values(ascending=ascending).index.to_numpy()
+        self.df = self.df.iloc[order]
+        #move persistent indexes such as the selection with their rows
+        newpos = np.empty(len(order), dtype=int)
+        newpos[order] = np.arange(len(order))
+        old = self.persistentIndexList()
+        new = [self.index(int(newpos[i.row()]), i.column()) for i in old]
+        self.changePersistentIndexList(old, new)
         self.layoutChanged.emit()
         return
 
@@ -950,10 +1132,14 @@ class DataFrameModel(QtCore.QAbstractTableModel):
         #print (index)
         i = index.row()
         j = index.column()
-        curr = self.df.iloc[i,j]
-        #print (curr, value)
-        self.df.iloc[i,j] = value
-        #self.dataChanged.emit()
+        #print (value)
+        self.df.iat[i,j] = value
+        #only this column needs to be read again
+        self.colcache.pop(j, None)
+        self.memory = None
+        tools.clear_lookups(self.df)
+        #only the edited cell is repainted
+        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
         return True
 
     #def onDataChanged(self):
@@ -1081,14 +1267,12 @@ class SampleTable(DataFrameTable):
                              QMessageBox.Yes, QMessageBox.No)
         if answer == QMessageBox.No:
             return
-        idx = self.model.df.index[rows]
-        self.model.df = self.model.df.drop(idx)
+        self.removeRows(rows)
         #also sync the geodataframe
         #mask = ~self.app.meta_table.index.isin(idx)
         #self.app.cent = self.app.cent[mask]
         #print (len(self.app.cent))
         self.app.update_groups()
-        self.refresh()
         return
 
     def deleteColumn(self, cols):
@@ -1099,10 +1283,9 @@ class SampleTable(DataFrameTable):
                              QMessageBox.Yes, QMessageBox.No)
         if answer == QMessageBox.No:
             return
-        self.model.df = self.model.df.drop(columns=cols)
+        self.removeColumn(cols)
         #also sync the geodataframe
         #self.app.cent = self.app.cent.drop(columns=cols)
-        self.refresh()
         return
 
 class SelectedModel(DataFrameModel):
@@ -1121,6 +1304,8 @@ class SelectedTable(DataFrameTable):
         self.parent = parent
         self.app = app
         tm = DataFrameModel(dataframe)
+        #the frame is the app's current selection
+        tm.shared = True
         self.setModel(tm)
         self.setProxyModel()
         #print (self.model)
@@ -1164,17 +1349,20 @@ class MovesTableModel(DataFrameModel):
 
         self.row_colors={}
         df = self.df
+        #colors are made once and shared by the rows
+        clrs = [QColor("#FAFAFA"), QColor("#EEEEEE")]
+        self.missing_color = QColor('#FA9B8D')
+        self.move_color = QColor('#9FBAFA')
         for i, idx in enumerate(df.index.unique()):
             #print (i,idx)
-            if i % 2 == 0:
-                self.row_colors[idx] = QColor("#FAFAFA")
-            else:
-                self.row_colors[idx] = QColor("#EEEEEE")
+            self.row_colors[idx] = clrs[i % 2]
         return
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         """Override data method"""
 
+        if role not in self.roles:
+            return None
         parent_data = super().data(index, role)
         i = index.row()
         j = index.column()
@@ -1184,15 +1372,13 @@ class MovesTableModel(DataFrameModel):
         if role == QtCore.Qt.BackgroundRole:
             row_color = self.row_colors[idx]
             colname = self.df.columns[j]
-            value = self.df.iloc[i, j]
+            value = self.getColumn(j)[0][i]
             if value == None:
-                clr = '#FA9B8D'
-                return QColor(clr)
+                return self.missing_color
             if colname == 'data_type' and value == 'F_to_F':
-                clr = '#9FBAFA' #'#FA9B8D'
-                return QColor(clr)
+                return self.move_color
             else:
-                return QColor(row_color)
+                return row_color
             return
 
 class MovesTable(DataFrameTable):
@@ -22,21 +22,27 @@
 
 import sys,os,subprocess,glob,shutil,re
 import random,time
+import functools
+import threading
+import io
 import json
 import platform
 import numpy as np
 import pandas as pd
 import pylab as plt
 import matplotlib as mpl
-from Bio.SeqRecord import SeqRecord
-from Bio.Seq import Seq
-from Bio import SeqIO
-from Bio import Phylo, AlignIO, Align
 import geopandas as gpd
-from shapely.geometry import Point, LineString, Polygon, MultiPolygon
+import shapely
+from shapely.geometry import Point, LineString, Polygon, MultiPolygon, box
 
 module_path = os.path.dirname(os.path.abspath(__file__))
 data_path = os.path.join(module_path,'data')
+#reprojected county borders, keyed by crs
+counties_cache = {}
+#indexed copies of tables used for lookups, keyed by column
+lookup_cache = {}
+#lookups are also made from worker threads
+lookup_lock = threading.RLock()
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -44,19 +50,104 @@ def resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
     return os.path.join(base_path, relative_path)
 
+def save_project(filename, data):
+    """
+    Save project data dict to file. The file is a zip archive with each
+    table stored as parquet and all other objects (figures, alignments,
+    selections etc.) pickled together. Large arrays in those objects, such
+    as scratchpad images, are written as separate buffers.
+    """
+
+    import zipfile, pickle
+    objects = {}
+    with zipfile.ZipFile(filename, 'w') as zf:
+        for key, obj in data.items():
+            if not isinstance(obj, pd.DataFrame):
+                objects[key] = obj
+                continue
+            buf = io.BytesIO()
+            try:
+                obj.to_parquet(buf, compression='zstd')
+            except Exception:
+                #tables parquet can't store e.g. non string column names
+                objects[key] = obj
+                continue
+            kind = 'geo' if isinstance(obj, gpd.GeoDataFrame) else 'df'
+            zf.writestr('%s.%s.parquet' %(key,kind), buf.getvalue())
+        #parquet is already compressed, only deflate the pickled objects
+        buffers = []
+        p = pickle.dumps(objects, protocol=5, buffer_callback=buffers.append)
+        zf.writestr('objects.pickle', p, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+        #array data goes straight to the archive without a copy into the pickle
+        for i,b in enumerate(buffers):
+            zf.writestr('buffers/%s' %i, b.raw(), compress_type=zipfile.ZIP_DEFLATED,
+                        compresslevel=1)
+    return
+
+def load_project(filename):
+    """Load project data dict. Older projects saved as a single pickle are also read."""
+
+    import zipfile, pickle
+    if not zipfile.is_zipfile(filename):
+        with open(filename,'rb') as f:
+            return pickle.load(f)
+    with zipfile.ZipFile(filename) as zf:
+        names = zf.namelist()
+        n = len([i for i in names if i.startswith('buffers/')])
+        #bytearray so the arrays are writeable
+        buffers = [bytearray(zf.read('buffers/%s' %i)) for i in range(n)]
+        data = pickle.loads(zf.read('objects.pickle'), buffers=buffers)
+        for name in names:
+            if not name.endswith('.parquet'):
+                continue
+            key, kind, ext = name.rsplit('.', 2)
+            buf = io.BytesIO(zf.read(name))
+            if kind == 'geo':
+                data[key] = gpd.read_parquet(buf)
+            else:
+                data[key] = pd.read_parquet(buf)
+    return data
+
 def update_project(filename, new, field, save=True):
     """Update tracebtb project file with data"""
 
-    import pickle
-    data = pickle.load(open(filename,'rb'))
+    data = load_project(filename)
     print (data.keys())
     if field in data:
         print ('overwriting field %s' %field)
     data[field] = new
     if save==True:
-        pickle.dump(data, open(filename,'wb'))
+        save_project(filename, data)
     return
 
+def read_csv(filename, fast=False, **kwargs):
+    """
+    Read csv file. If fast is set the multithreaded pyarrow parser is used
+    when available. It infers dates and does not take all the options of the
+    default parser, so it falls back to that for any options it rejects.
+    """
+
+    if fast == True:
+        try:
+            import pyarrow
+            return pd.read_csv(filename, engine='pyarrow', **kwargs)
+        except (ImportError, ValueError):
+            pass
+    return pd.read_csv(filename, **kwargs)
+
+def clades_to_str(df, cols):
+    """
+    Convert clade columns to strings in one pass. Columns that already hold
+    only strings are skipped, missing values become 'nan' as with astype.
+    """
+
+    infer = pd.api.types.infer_dtype
+    dtypes = {c: str for c in cols if c in df.columns
+                and (df[c].dtype != object or infer(df[c], skipna=False) != 'string')}
+    if len(dtypes) == 0:
+        return df
+    return df.astype(dtypes)
+
 def random_hex_color():
     """random hex color"""
 
@@ -72,7 +163,7 @@ def random_hex_colors(n=1,seed=None):
 def colormap_colors(colormap_name, n):
     """Colors list from mpl colormap"""
 
-    colormap = plt.cm.get_cmap(colormap_name, n)
+    colormap = mpl.colormaps[colormap_name].resampled(n)
     colors = [mpl.colors.rgb2hex(colormap(i)) for i in range(n)]
     return colors
 
@@ -80,27 +171,37 @@ def colormap_from_labels(colormap_name, labels):
     """Get dict of colors mapping to labels using mpl colormap"""
 
     n = len(labels)
-    colormap = plt.cm.get_cmap(colormap_name, n)
+    colormap = mpl.colormaps[colormap_name].resampled(n)
     colors = {labels[i]: mpl.colors.rgb2hex(colormap(i)) for i in range(n)}
     return colors
 
-def random_colors(n=10, seed=1):
-    """Generate random hex colors as list of length n."""
-
-    import random
-    random.seed(seed)
+@functools.lru_cache(maxsize=64)
+def _random_colors(n, seed):
+    rand = random.Random(seed)
     clrs=[]
     for i in range(n):
-        r = lambda: random.randint(0,255)
+        r = lambda: rand.randint(0,255)
         c='#%02X%02X%02X' % (r(),r(),r())
         clrs.append(c)
-    return clrs
+    return tuple(clrs)
+
+def random_colors(n=10, seed=1):
+    """Generate random hex colors as list of length n.
+    The same n and seed always give the same colors so they are cached."""
+
+    return list(_random_colors(n, seed))
 
 def random_grayscale_color(_):
 
     gray_value = np.random.randint(0, 256)
     return f'#{gray_value:02X}{gray_value:02X}{gray_value:02X}'
 
+def random_grayscale_colors(n):
+    """List of n random gray hex colors"""
+
+    vals = np.random.randint(0, 256, n)
+    return ['#{0:02X}{0:02X}{0:02X}'.format(v) for v in vals]
+
 def random_colormap_colors(cmap_name, n):
     """
     Get n random colors from a Matplotlib colormap.
@@ -125,9 +226,8 @@ def gen_colors(cmap,n,reverse=False):
     see also https://matplotlib.org/stable/tutorials/colors/colormaps.html
     '''
 
-    import matplotlib.pyplot as plt
     import matplotlib.colors as colors
-    c_map = plt.cm.get_cmap(str(cmap)) # select the desired cmap
+    c_map = mpl.colormaps[str(cmap)] # select the desired cmap
     arr = np.linspace(0,1,n) #create a list with numbers from 0 to 1 with n items
     colorlist=list()
     for c in arr:
@@ -151,21 +251,30 @@ def get_color_mapping(df, col, cmap=None, seed=12):
     """Get random color map for categorical dataframe column"""
 
     import matplotlib.colors as colors
-    c = df.sort_values(col)[col].unique()
+    #categorical codes index straight into the color list, missing values get -1
+    #so are given the last color, as their own category
+    cat = pd.Categorical(df[col])
+    c = list(cat.categories)
+    if (cat.codes == -1).any():
+        c.append(np.nan)
     if cmap == None:
         clrs = random_colors(len(c),seed)
     else:
-        c_map = mpl.cm.get_cmap(cmap)
+        c_map = mpl.colormaps[cmap]
         clrs = [colors.rgb2hex(c_map(i)) for i in range(len(c))]
         #colors = gen_colors(cmap,len(c))
 
     colormap = dict(zip(c, clrs))
-    newcolors =  [colormap[i] if i in colormap else 'Black' for i in df[col]]
+    lut = np.array(clrs, dtype=object)
+    newcolors = lut[cat.codes].tolist()
     return newcolors, colormap
 
 def alignment_from_snps(df):
     """MultipleSeqAlignment object from core snps"""
 
+    from Bio.SeqRecord import SeqRecord
+    from Bio.Seq import Seq
+    from Bio import Align
     df = df.set_index('pos').T
     seqs=[]
     for i,r in df.iterrows():
@@ -290,6 +399,7 @@ def check_keys(d, vals):
 def subset_alignment(aln, names):
     """Subset of a multpleseqalignment object"""
 
+    from Bio import Align
     seqs = [rec for rec in aln if rec.id in names]
     new = Align.MultipleSeqAlignment(seqs)
     return new
@@ -297,9 +407,31 @@ def subset_alignment(aln, names):
 def get_coords_data(df):
     """Get coordinates from geodataframe as linestrings"""
 
-    df['P2'] = df.geometry.shift(-1)
-    coords = df[:-1].apply(lambda x: LineString([x.geometry,x.P2]),1)
-    return coords
+    if len(df) < 2:
+        return gpd.GeoSeries([], crs=df.crs)
+    #x and y keep one value per row, empty points give nan
+    xy = np.column_stack([df.geometry.x.to_numpy(), df.geometry.y.to_numpy()])
+    coords = np.stack([xy[:-1], xy[1:]], axis=1)
+    ok = np.isfinite(coords).all(axis=(1,2))
+    lines = shapely.linestrings(coords[ok])
+    return gpd.GeoSeries(lines, index=df.index[:-1][ok], crs=df.crs)
+
+def get_move_segments(moves):
+    """
+    Start and end coords of every move as an array of rows
+    (x1, y1, x2, y2). Moves should be sorted by tag and date, each row
+    is joined to the next one for the same animal.
+    """
+
+    moves = moves[moves.geometry.notnull()]
+    if 'tag' in moves.columns:
+        tags = moves['tag'].to_numpy()
+    else:
+        tags = moves.index.to_numpy()
+    x = moves.geometry.x.to_numpy()
+    y = moves.geometry.y.to_numpy()
+    same = tags[1:] == tags[:-1]
+    return np.column_stack([x[:-1][same], y[:-1][same], x[1:][same], y[1:][same]])
 
 def pca(matrix):
     """Perform PCA"""
@@ -373,8 +505,6 @@ def create_grid(gdf=None, bounds=None, n_cells=10, overlap=False, crs="EPSG:2990
     returns: a GeoDataFrame of grid polygons
     """
 
-    import geopandas as gpd
-    import shapely
 
     if bounds != None:
         xmin, ymin, xmax, ymax= bounds
@@ -405,8 +535,6 @@ def create_hex_grid(gdf=None, bounds=None, n_cells=10, overlap=False, crs="EPSG:
     See https://sabrinadchan.github.io/data-blog/building-a-hexagonal-cartogram.html
     """
 
-    from shapely.geometry import Polygon
-    import geopandas as gpd
     if bounds != None:
         xmin, ymin, xmax, ymax= bounds
     else:
@@ -456,15 +584,11 @@ def count_points_in_grid(grid, gdf, value_column='count', threshold=None):
     Returns:
     - grid: GeoDataFrame with a new column `value_column` containing the count of points.
     """
-    import geopandas as gpd
-    import matplotlib.pyplot as plt
 
-    # Perform a spatial join to find points within each hexagon
-    joined = gpd.sjoin(gdf, grid, how='inner', predicate='within')
+    # Find the cell each point is within using the grid spatial index
+    pts, cells = grid.sindex.query(gdf.geometry.values, predicate='within')
     # Count the number of points in each grid cell
-    point_counts = joined.groupby('grid_id').size()
-    # Add point counts to the grid GeoDataFrame
-    grid[value_column] = grid['grid_id'].map(point_counts).fillna(0).astype(int)
+    grid[value_column] = np.bincount(cells, minlength=len(grid))
     if threshold != None:
         grid = grid[grid['count']>threshold].copy()
     return grid
@@ -483,7 +607,6 @@ def get_count_grid(df, grid=None, n_cells=30):
 def nearest(point, gdf):
     """Get nearest neighbours to point in gdf, vector based"""
 
-    from shapely.ops import nearest_points
     dists = gdf.apply(lambda row: point.distance(row.geometry),axis=1)
     return dists[dists>0].min()
 
@@ -503,15 +626,31 @@ def find_outliers(gdf, min_dist=10, min_samples=10, col='snp7'):
     Find outlier cluster points
     """
 
-    res=[]
-    for i,df in gdf.groupby(col):
-        if len(df)>=min_samples:
-            df['nearest'] = df.geometry.apply(lambda x: nearest(x,df))
-            df['outlier'] = df.nearest>min_dist*100
-            #print (i,len(df))
-        res.append(df)
-    res = pd.concat(res)
-    outliers = res[res.outlier==True]
+    x = gdf.geometry.x.to_numpy()
+    y = gdf.geometry.y.to_numpy()
+    rows = []
+    dists = []
+    for i,idx in gdf.groupby(col).indices.items():
+        if len(idx) < min_samples:
+            continue
+        gx, gy = x[idx], y[idx]
+        near = np.empty(len(idx))
+        #distances to the rest of the group in blocks to limit memory
+        for s in range(0, len(idx), 1000):
+            d = np.hypot(gx[s:s+1000,None]-gx, gy[s:s+1000,None]-gy)
+            #same location or missing coords don't count as nearest
+            d[~(d>0)] = np.inf
+            near[s:s+1000] = d.min(axis=1)
+        near[np.isinf(near)] = np.nan
+        rows.append(idx)
+        dists.append(near)
+    if len(rows) == 0:
+        return gdf.iloc[[]].assign(nearest=[], outlier=[])
+    #collect positions and build the result once
+    rows = np.concatenate(rows)
+    dists = np.concatenate(dists)
+    keep = dists>min_dist*100
+    outliers = gdf.iloc[rows[keep]].assign(nearest=dists[keep], outlier=True)
     return outliers
 
 def remove_outliers_zscore(gdf, threshold=3):
@@ -637,39 +776,90 @@ def herd_summary(df, moves, snpdist=None):
 def cluster_summary(df, col, min_size=5, snpdist=None):
     """Group summary e.g. by cluster"""
 
-    res = []
-    for c,sub in df.groupby(col):
-        if len(sub)<min_size:
-            continue
-        herds = len(sub.HERD_NO.unique())
-        idx = list(sub.index)
-        if snpdist is not None:
-            D = snpdist.loc[idx,idx]
-            meandist = D.stack().mean().round(1)
-            mediandist = D.stack().median().round(1)
-        if 'Homebred' in sub.columns:
-            hbred = len(sub[sub.Homebred=='yes'])
-        else:
-            hbred = None
-        #species=sub.Species.value_counts()
-        badger = len(sub[sub.Species=='Badger'])
-        clade = sub.iloc[0].IE_clade
-        row = [c,len(sub),hbred,herds,badger,mediandist,clade]
-        res.append(row)
-    res=pd.DataFrame(res, columns=['cluster','isolates','homebred','herds','badger','median_dist','IE_clade'])
-    res=res.sort_values('isolates',ascending=False)
+    sizes = df.groupby(col)[col].transform('size')
+    df = df[(sizes >= min_size).values]
+    g = df.groupby(col)
+    #aggregate all groups at once instead of looping over them
+    res = pd.DataFrame({'isolates': g.size()})
+    if 'Homebred' in df.columns:
+        res['homebred'] = (df.Homebred=='yes').groupby(df[col]).sum()
+    else:
+        res['homebred'] = None
+    res['herds'] = g.HERD_NO.nunique()
+    res['badger'] = (df.Species=='Badger').groupby(df[col]).sum()
+    if snpdist is not None:
+        #only the distances need each group separately
+        res['median_dist'] = [snpdist.loc[g.groups[c],g.groups[c]].stack().median().round(1)
+                                for c in res.index]
+    else:
+        res['median_dist'] = None
+    res['IE_clade'] = df.drop_duplicates(col).set_index(col).IE_clade
+    res = res.rename_axis('cluster').reset_index()
+    res = res.sort_values('isolates',ascending=False)
     return res
 
+def get_lookup(df, key):
+    """
+    Copy of df indexed and sorted on a column, kept until a different
+    table is passed for the same column.
+    """
+
+    with lookup_lock:
+        c = lookup_cache.get(key)
+        if c is None or c[0] is not df:
+            idx = df.set_index(key, drop=False).sort_index()
+            idx.index.name = None
+            c = (df, idx)
+            lookup_cache[key] = c
+    return c[1]
+
+def clear_lookups(df):
+    """
+    Drop cached lookups made from df or its geometries. Needed when the
+    table is changed in place, since the caches only check identity.
+    """
+
+    geoms = None
+    if isinstance(df, gpd.GeoDataFrame):
+        try:
+            geoms = df.geometry.values
+        except AttributeError:
+            pass
+    with lookup_lock:
+        for k in list(lookup_cache):
+            c = lookup_cache[k][0]
+            if c is df or (geoms is not None and c is geoms):
+                del lookup_cache[k]
+    return
+
+def get_group_index(df, key):
+    """
+    Row positions of each value of a column, kept until a different
+    table is passed for the same column.
+    """
+
+    with lookup_lock:
+        c = lookup_cache.get(('groups', key))
+        if c is None or c[0] is not df:
+            c = (df, df.groupby(key).indices)
+            lookup_cache[('groups', key)] = c
+    return c[1]
+
 def get_moves_bytag(df, move_df, lpis_cent):
     """
     Get moves and coords for one or more samples.
     """
 
-    cols=['Animal_ID']+list(move_df.columns)
-    t = df.merge(move_df,left_on='Animal_ID',right_on='tag',how='inner')[cols]
-    #print (t)
-    #merge result with parcel cents to get coords of moved_to farms
-    m = t.merge(lpis_cent,left_on='move_to',right_on='SPH_HERD_N', how='left')
+    #look up rows in indexed tables rather than merging the full tables each time
+    moves = get_lookup(move_df, 'tag')
+    tags = moves.index.intersection(df.Animal_ID.dropna().unique())
+    t = moves.loc[tags]
+    #add parcel cents to get coords of moved_to farms, only the herds
+    #and columns needed go into the merge
+    cent = get_lookup(lpis_cent, 'SPH_HERD_N')
+    herds = cent.index.intersection(t.move_to.dropna().unique())
+    cent = cent.loc[herds, ['SPH_HERD_N', cent.geometry.name]]
+    m = t.merge(cent, left_on='move_to', right_index=True, how='left', sort=False)
     if len(m)==0:
         return
     m = (m.drop_duplicates()
@@ -681,26 +871,31 @@ def get_moves_bytag(df, move_df, lpis_cent):
     return m
 
 def apply_jitter(gdf, radius=100):
-    """Apply jitter to points on same farm"""
-
-    def circular_jitter(centroid, points, radius):
-        angles = np.linspace(0, 2 * np.pi, len(points), endpoint=False)
-        jittered_points = []
-        for angle in angles:
-            x = radius * np.cos(angle)
-            y = radius * np.sin(angle)
-            jittered_points.append(Point(centroid.x + x, centroid.y + y))
-        return jittered_points
-
-    #Group by 'HERD_NO' and apply jitter to overlapping points
-    for herd, group in gdf.groupby('HERD_NO'):
-        #print (group)
-        if len(group) <= 1: continue
-        centroid = group['geometry'].iloc[0]
-        if centroid == None or centroid.is_empty: continue
-        jittered = circular_jitter(centroid, group['geometry'], radius)
-        #print (jittered)
-        gdf.loc[group.index, 'geometry'] = jittered
+    """
+    Apply jitter to points on same farm. Points in a herd are spread evenly
+    on a circle around the first point of that herd.
+    """
+
+    codes, herds = pd.factorize(gdf['HERD_NO'])
+    rows = np.flatnonzero(codes >= 0)
+    c = codes[rows]
+    counts = np.bincount(c, minlength=len(herds))
+    #position of each point within its herd and the first row of the herd
+    pos = pd.Series(c).groupby(c).cumcount().to_numpy()
+    u, first = np.unique(c, return_index=True)
+    firstrow = np.zeros(len(herds), dtype=int)
+    firstrow[u] = rows[first]
+
+    geoms = np.array(gdf['geometry'].values, dtype=object)
+    centroid = geoms[firstrow[c]]
+    ok = (counts[c] > 1) & ~(shapely.is_missing(centroid) | shapely.is_empty(centroid))
+    if not ok.any():
+        return gdf
+    angles = 2 * np.pi * pos[ok] / counts[c][ok]
+    xy = shapely.get_coordinates(centroid[ok])
+    geoms[rows[ok]] = shapely.points(xy[:,0] + radius * np.cos(angles),
+                                     xy[:,1] + radius * np.sin(angles))
+    gdf['geometry'] = gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs)
     return gdf
 
 def get_largest_poly(x):
@@ -714,15 +909,144 @@ def get_largest_poly(x):
 def calculate_parcel_centroids(parcels):
     """Get centroids of lpis parcels"""
 
-    largest = parcels.geometry.apply(get_largest_poly)
-    cent = largest.geometry.centroid
+    #largest part of each (multi)polygon found for all rows at once
+    geoms = parcels.geometry.values
+    parts, idx = shapely.get_parts(geoms, return_index=True)
+    order = np.lexsort((-shapely.area(parts), idx))
+    idx = idx[order]
+    first = np.r_[True, idx[1:] != idx[:-1]]
+    largest = np.full(len(geoms), None, dtype=object)
+    largest[idx[first]] = parts[order][first]
+    cent = gpd.GeoSeries(shapely.centroid(largest), index=parcels.index)
     cent = gpd.GeoDataFrame(geometry=cent,crs='EPSG:29902')
     cent['SPH_HERD_N'] = parcels.SPH_HERD_N
     return cent
 
+def get_counties(crs='EPSG:29902'):
+    """
+    County borders in the given crs. Reprojected once and cached, also as
+    parquet in the config folder so later sessions skip the reprojection.
+    """
+
+    from . import core
+    if crs in counties_cache:
+        return counties_cache[crs]
+    filename = os.path.join(data_path,'counties.shp')
+    cache_path = os.path.join(core.config_path, 'cache')
+    name = 'counties_%s' %crs.replace(':','').lower()
+    cachefile = os.path.join(cache_path, '%s_%s.parquet' %(name, int(os.stat(filename).st_mtime)))
+    gdf = None
+    if os.path.exists(cachefile):
+        try:
+            gdf = gpd.read_parquet(cachefile)
+        except Exception as e:
+            print ('could not read cached counties: %s' %e)
+    if gdf is None:
+        gdf = gpd.read_file(filename, engine='pyogrio', use_arrow=True).to_crs(crs)
+        try:
+            os.makedirs(cache_path, exist_ok=True)
+            for f in glob.glob(os.path.join(cache_path, name+'_*.parquet')):
+                os.remove(f)
+            gdf.to_parquet(cachefile)
+        except Exception as e:
+            print ('could not cache counties: %s' %e)
+    counties_cache[crs] = gdf
+    return gdf
+
+def get_point_coords(gdf, key='xy'):
+    """
+    x and y arrays if all geometries are points, otherwise None. Kept
+    until a table with different geometries is passed with the same key.
+    """
+
+    geoms = gdf.geometry.values
+    with lookup_lock:
+        c = lookup_cache.get(key)
+        if c is None or c[0] is not geoms:
+            types = shapely.get_type_id(np.asarray(geoms))
+            if len(types) > 0 and (types == 0).all():
+                xy = (gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy())
+            else:
+                xy = None
+            c = (geoms, xy)
+            lookup_cache[key] = c
+    return c[1]
+
+def get_in_region(gdf, xmin, xmax, ymin, ymax):
+    """
+    Rows of gdf intersecting a bounding box. Same result as gdf.cx.
+    Point tables are filtered by comparing cached coordinate arrays,
+    others use the spatial index, which geopandas builds once and keeps.
+    """
+
+    xy = get_point_coords(gdf)
+    if xy is not None:
+        x, y = xy
+        mask = (x>=xmin) & (x<=xmax) & (y>=ymin) & (y<=ymax)
+        return gdf.iloc[np.flatnonzero(mask)]
+    idx = gdf.sindex.query(box(xmin, ymin, xmax, ymax), predicate='intersects')
+    return gdf.iloc[np.sort(idx)]
+
+def read_parcels(filename, cache=True):
+    """
+    Read a parcels shapefile. A parquet copy is kept in the config folder
+    so later reads of the same unchanged file are much faster.
+    """
+
+    from . import core
+    if cache == False:
+        return gpd.read_file(filename, engine='pyogrio', use_arrow=True).set_crs('EPSG:29902')
+    cache_path = os.path.join(core.config_path, 'cache')
+    st = os.stat(filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+    cachefile = os.path.join(cache_path, '%s_%s_%s.parquet' %(name, st.st_size, int(st.st_mtime)))
+    if os.path.exists(cachefile):
+        try:
+            return gpd.read_parquet(cachefile)
+        except Exception as e:
+            print ('could not read cached parcels: %s' %e)
+    gdf = gpd.read_file(filename, engine='pyogrio', use_arrow=True).set_crs('EPSG:29902')
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        #remove older copies of this file
+        for f in glob.glob(os.path.join(cache_path, name+'_*.parquet')):
+            os.remove(f)
+        gdf.to_parquet(cachefile)
+    except Exception as e:
+        print ('could not cache parcels: %s' %e)
+    return gdf
+
+def get_herd_index(parcels, cache=False):
+    """
+    Map of herd number to row positions in a parcels table. If cache is
+    set the index is kept until a different table is passed.
+    """
+
+    if cache == False:
+        return parcels.groupby('SPH_HERD_N').indices
+    with lookup_lock:
+        c = lookup_cache.get('herd_index')
+        if c is None or c[0] is not parcels:
+            c = (parcels, parcels.groupby('SPH_HERD_N').indices)
+            lookup_cache['herd_index'] = c
+    return c[1]
+
+def get_herd_parcels(parcels, herds, index=None):
+    """
+    Get parcels for a set of herds. If a herd index from get_herd_index is
+    provided only the matching rows are touched instead of scanning the table.
+    """
+
+    if index is None:
+        return parcels[parcels.SPH_HERD_N.isin(herds)]
+    rows = [index[h] for h in set(herds) if h in index]
+    if len(rows) == 0:
+        return parcels.iloc[[]]
+    return parcels.iloc[np.sort(np.concatenate(rows))]
+
 def get_county(x):
 
-    counties = gpd.read_file(os.path.join(data_path,'counties.shp')).to_crs("EPSG:3857")
+    counties = get_counties("EPSG:3857")
     if x.geometry.is_empty:
         return 'NA'
     found = counties[counties.contains(x.geometry)]
@@ -812,14 +1136,17 @@ def spatial_cluster(gdf, eps=3000):
 def find_neighbours(gdf, dist, lpis_cent, lpis):
     """Find neighbouring herds"""
 
-    found = []
-    for x in gdf.geometry:
-        dists = lpis_cent.distance(x)
-        points = lpis_cent[(dists<=dist) & (dists>10)]
-        found.append(points)
-    if len(found) == 0:
+    if len(gdf) == 0:
         return lpis_cent.drop(lpis_cent.index)
-    found = pd.concat(found).drop_duplicates()
+    #all pairs within dist from the spatial index, in one query
+    geoms = gdf.geometry.values
+    try:
+        src, tgt = lpis_cent.sindex.query(geoms, predicate='dwithin', distance=dist)
+    except (TypeError, ValueError, NotImplementedError):
+        #older geopandas/GEOS without dwithin, query buffered points instead
+        src, tgt = lpis_cent.sindex.query(geoms.buffer(dist), predicate='intersects')
+    dists = shapely.distance(geoms[src], lpis_cent.geometry.values[tgt])
+    found = lpis_cent.iloc[np.unique(tgt[(dists <= dist) & (dists > 10)])]
     x = lpis[lpis.SPH_HERD_N.isin(found.SPH_HERD_N)]
     #exclude those in source gdf
     x = x[~x.SPH_HERD_N.isin(gdf.HERD_NO)]
@@ -828,17 +1155,15 @@ def find_neighbours(gdf, dist, lpis_cent, lpis):
 def shared_borders(parcels, lpis):
     """Find neighbouring herds with shared borders"""
 
-    found = []
     if type(parcels) is pd.Series:
         parcels = parcels.to_frame().T
-    for i, r in parcels.iterrows():
-        #farms with shared borders
-        polygon = r.geometry
-        x = lpis[lpis.touches(polygon)]
-        found.append(x)
-    if len(found) == 0:
+        parcels = gpd.GeoDataFrame(parcels, geometry='geometry', crs=lpis.crs)
+    if len(parcels) == 0:
         return
-    found = pd.concat(found)
+    src, tgt = lpis.sindex.query(parcels.geometry.values, predicate='touches')
+    #same order as checking each parcel in turn
+    order = np.lexsort((tgt, src))
+    found = lpis.iloc[tgt[order]]
     found = found[~found.SPH_HERD_N.isin(parcels.SPH_HERD_N)]
     return found
 
@@ -849,7 +1174,7 @@ def plot_neighbours(pcl,df,col=None,pad=.3,ax=None):
     point = pcl.iloc[0].geometry.centroid
     df.plot(lw=.5,ec='black',alpha=0.6,column=col,legend=False,cmap='Set3',ax=ax)
     pcl.plot(color='red',lw=0,ec='black',ax=ax)
-    x1,y1,x2,y2 = df.union_all().bounds
+    x1,y1,x2,y2 = df.total_bounds
     pad = (x2-x1)*pad
     ax.set_xlim(point.x-pad,point.x+pad)
     ax.set_ylim(point.y-pad,point.y+pad)
@@ -20,10 +20,6 @@
 
 import sys,os,subprocess,glob,shutil,re,random
 import platform
-from Bio.SeqRecord import SeqRecord
-from Bio.Seq import Seq
-from Bio import SeqIO
-from Bio import Phylo, AlignIO
 import numpy as np
 import pandas as pd
 from  . import tools
@@ -42,9 +38,9 @@ def set_tiplabels(t, labelmap):
 
 def get_colormap(values):
 
-    import pylab as plt
+    import matplotlib as mpl
     labels = values.unique()
-    cmap = plt.cm.get_cmap('Set1')
+    cmap = mpl.colormaps['Set1']
     colors = [cmap(i) for i in range(len(labels))]
     #colors=qcolors
     #clrs = {labels[i]:cmap(float(i)/(len(labels))) for i in range(len(labels))}
@@ -97,6 +93,7 @@ def run_RAXML(infile, name='variants', threads=8, bootstraps=100, outpath='.'):
 
 def convert_branch_lengths(treefile, outfile, snps):
 
+    from Bio import Phylo
     tree = Phylo.read(treefile, "newick")
     for parent in tree.find_clades(terminal=False, order="level"):
             for child in parent.clades:
@@ -111,6 +108,7 @@ def tree_from_aln(aln):
 
     if len(aln) == 0:
         return
+    from Bio import AlignIO
     AlignIO.write(aln, 'temp.fa', 'fasta')
     treefile = run_fasttree('temp.fa')
     ls = len(aln[0])
@@ -127,6 +125,8 @@ def tree_from_snps(snpmat):
 def njtree_from_snps(df):
     """NJ tree from core SNP alignment"""
 
+    from Bio import Phylo
+    from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
     aln = tools.alignment_from_snps(df)
     # Calculate the pairwise distances
     calculator = DistanceCalculator("identity")
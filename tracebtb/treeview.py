@@ -276,10 +276,9 @@ class TreeViewer(QWidget):
             return
 
         canvas = trees.draw_tree(treefile, self.sub, colorcol)
-        toyplot.html.render(canvas, "temp.html")
-        with open('temp.html', 'r') as f:
-            html = f.read()
-            self.browser.setHtml(html)
+        #render to a string rather than through a temp file
+        html = toyplot.html.tostring(canvas)
+        self.browser.setHtml(html)
         self.canvas = canvas
         return
 
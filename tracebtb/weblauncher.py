@@ -9,7 +9,6 @@
 import sys,os,time,re
 import platform
 from datetime import datetime
-import pickle
 import glob,io
 import json
 import math
@@ -23,7 +22,7 @@ from bokeh.models import Range1d, CustomJS, TapTool
 import panel as pn
 import panel.widgets as pnw
 
-from tracebtb import dashboards, bokeh_plot
+from tracebtb import dashboards, bokeh_plot, tools
 
 module_path = os.path.dirname(os.path.abspath(__file__)) #path to module
 data_path = os.path.join(module_path,'data')
@@ -118,7 +117,7 @@ def main():
             lpis_master_file = settings['lpis_master_file']
             treefile = settings['tree_file']
 
-        data = pickle.load(open(args.project,'rb'))
+        data = tools.load_project(args.project)
         meta = data['meta']
         moves = data['moves']
         lpis_cent = data['lpis_cent']
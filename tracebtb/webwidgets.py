@@ -40,16 +40,12 @@ except AttributeError:
 module_path = os.path.dirname(os.path.abspath(__file__))
 iconpath = os.path.join(module_path, 'icons')
 data_path = os.path.join(module_path,'data')
-borders = gpd.read_file(os.path.join(data_path,'counties.shp'))
+borders = gpd.read_file(os.path.join(data_path,'counties.shp'), engine='pyogrio', use_arrow=True)
 
 def get_bounds(gdf):
     """Get bounding coords for points in gdf"""
 
-    bounding_box = gdf.bounds
-    minx = bounding_box['minx'].min()
-    miny = bounding_box['miny'].min()
-    maxx = bounding_box['maxx'].max()
-    maxy = bounding_box['maxy'].max()
+    minx, miny, maxx, maxy = gdf.total_bounds
     return minx, miny, maxx, maxy
 
 def create_map(location=[-51, 8]):
@@ -116,8 +112,8 @@ def plot_folium(sub=None, parcels=None, neighbours=None, moves=None, lpis_cent=N
     minx, miny, maxx, maxy = get_bounds(df)
     pad=.05
     bbox = [(miny-pad,minx-pad),(maxy+pad,maxx+pad)]
-    c = df.dissolve().centroid.geometry
-    bounds = df.bounds
+    #center of the points, no need to merge all geometries first
+    c = shapely.Point(df.geometry.x.mean(), df.geometry.y.mean())
     #fig = Figure()
     map = folium.Map(location=[c.y, c.x], crs='EPSG3857',tiles='openstreetmap',
                         width=width, height=height ,max_bounds=True, control_scale = True)
@@ -196,19 +192,20 @@ def plot_moves_folium(moves, lpis_cent, map):
         return
     #fg = folium.FeatureGroup("Moves")
     moves = moves[moves.geometry.notnull()].to_crs('EPSG:4326')
+    #herd centroids indexed by herd, only those moved to and projected once
+    cent = tools.get_lookup(lpis_cent, 'SPH_HERD_N')
+    cent = cent.loc[cent.index.intersection(moves.move_to.dropna().unique())].to_crs('EPSG:4326')
 
     i=0
     for tag,t in moves.groupby('tag'):
         if t is not None:
-            moved = lpis_cent[lpis_cent.SPH_HERD_N.isin(t.move_to)].to_crs('EPSG:4326')
+            moved = cent.loc[cent.index.intersection(t.move_to.dropna().unique())]
             coords = tools.get_coords_data(t)
-            #reverse coords to long-lat
-            coords = coords.map(lambda l: shapely.ops.transform(lambda x, y: (y, x), l))
-
             if len(coords)==0:
                 continue
-            for c in coords:
-                loc = list(c.coords)
+            #swap all coords to lat-long at once
+            lines = shapely.get_coordinates(coords.values)[:,::-1].reshape(-1,2,2)
+            for loc in lines.tolist():
                 tip=tag
                 l=folium.PolyLine(locations=loc, color='blue', weight=1, tooltip=tip).add_to(map)
 
@@ -22,6 +22,7 @@
 
 import sys, os, io, platform, traceback
 import json
+import functools
 import numpy as np
 import pandas as pd
 import pylab as plt
@@ -31,7 +32,7 @@ from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as Navigatio
 from matplotlib.figure import Figure
 import string
 from .qt import *
-from . import core, plotting
+from . import core, plotting, tools
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
@@ -42,6 +43,12 @@ except AttributeError:
 module_path = os.path.dirname(os.path.abspath(__file__))
 iconpath = os.path.join(module_path, 'icons')
 
+@functools.lru_cache(maxsize=None)
+def getIcon(iconfile):
+    """Get icon from file, each file is only loaded once"""
+
+    return QIcon(iconfile)
+
 def add_subplots_to_figure(fig, rows, cols):
 
     fig.clf()
@@ -69,8 +76,7 @@ def createButton(parent, name, function, iconname=None, iconsize=20,
     #button.setGeometry(QtCore.QRect(40,40,40,40))
     button.setText(name)
     iconfile = os.path.join(iconpath,iconname)
-    icon = QIcon(iconfile)
-    button.setIcon(QIcon(icon))
+    button.setIcon(getIcon(iconfile))
     button.setIconSize(QtCore.QSize(iconsize,iconsize))
     button.clicked.connect(function)
     #button.setMinimumWidth(20)
@@ -305,7 +311,7 @@ def addToolBarItems(toolbar, parent, items):
     for i in items:
         if 'file' in items[i]:
             iconfile = os.path.join(iconpath,items[i]['file'])
-            icon = QIcon(iconfile)
+            icon = getIcon(iconfile)
         else:
             icon = QIcon.fromTheme(items[i]['icon'])
         btn = QAction(icon, i, parent)
@@ -1089,11 +1095,11 @@ class PlotViewer(QWidget):
         self.fig = fig
         self.canvas = canvas
         iconfile = os.path.join(iconpath,'reduce')
-        a = QAction(QIcon(iconfile), "Reduce elements",  self)
+        a = QAction(getIcon(iconfile), "Reduce elements",  self)
         a.triggered.connect(lambda: self.zoom(zoomin=False))
         self.toolbar.addAction(a)
         iconfile = os.path.join(iconpath,'enlarge')
-        a = QAction(QIcon(iconfile), "Enlarge elements",  self)
+        a = QAction(getIcon(iconfile), "Enlarge elements",  self)
         a.triggered.connect(lambda: self.zoom(zoomin=True))
         self.toolbar.addAction(a)
         return
@@ -1226,7 +1232,7 @@ class PlotViewer(QWidget):
         clrs=[]
         df = df._get_numeric_data()
         cols = len(df.columns)
-        cmap = plt.cm.get_cmap(kwds['colormap'])
+        cmap = mpl.colormaps[kwds['colormap']]
         for i,d in enumerate(df):
             clrs.append(cmap(float(i)/cols))
             data.append(df[d].values)
@@ -1272,7 +1278,10 @@ class PlotViewer(QWidget):
         return
 
     def redraw(self):
-        self.canvas.draw()
+        """Schedule a redraw, repeated calls are merged into one draw"""
+
+        self.canvas.draw_idle()
+        return
 
     def zoom(self, zoomin=True):
         """Zoom in/out to plot by changing size of elements"""
@@ -1298,9 +1307,110 @@ class CustomPlotViewer(PlotViewer):
         #self.fig.canvas.mpl_connect('button_release_event', self.onrelease)
         #self.fig.canvas.mpl_connect('pick_event', self.onpick)
         self.fig.canvas.mpl_connect('motion_notify_event', self.motion_hover)
+        #keep the background from every full draw so overlays can be blitted
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
         self.app = app
         self.lims = None
         self.opts = PlotOptions()
+        self.background = None
+        self.background_key = None
+        self.static_background = None
+        self.static_key = None
+        self.drawing_static = False
+        self.overlay = []
+        return
+
+    def clear(self, draw=True):
+        """Clear plot and saved background. If draw is False the caller
+        is expected to draw the canvas."""
+
+        self.fig.clear()
+        self.ax = self.fig.add_subplot(111)
+        self.background = None
+        self.overlay = []
+        if draw == True:
+            self.canvas.draw_idle()
+        return
+
+    def set_overlay(self, artists):
+        """Artists left out of the background and drawn over it, e.g. labels"""
+
+        for a in artists:
+            a.set_animated(True)
+        self.overlay = list(artists)
+        return
+
+    def on_draw(self, event):
+        """After a full draw store the background and draw the overlay on it"""
+
+        if self.drawing_static == True:
+            return
+        if not self.fig.canvas.is_saving():
+            self.save_background()
+        #overlay artists are animated so the figure skips them, also when saving
+        for a in self.overlay:
+            a.draw(event.renderer)
+        return
+
+    def draw_layers(self, static, key):
+        """
+        Draw the canvas once, reusing the rendered static artists (e.g. borders
+        and basemap) from the last call if key and the view are unchanged. All
+        other artists in the axes are drawn over them with blitting, then the
+        result is kept as the background and the overlay drawn on top.
+        """
+
+        ax = self.ax
+        key = (key, self.get_plot_lims(), self.canvas.get_width_height())
+        skip = set(static) | set(self.overlay) | {ax.patch, ax.xaxis, ax.yaxis} \
+                | set(ax.spines.values())
+        fg = [a for a in ax.get_children() if a not in skip]
+        if self.static_background is None or key != self.static_key:
+            #render the static layers alone and keep the image
+            for a in fg:
+                a.set_animated(True)
+            self.drawing_static = True
+            try:
+                self.canvas.draw()
+            finally:
+                self.drawing_static = False
+            self.static_background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self.static_key = key
+        else:
+            self.canvas.restore_region(self.static_background)
+        for a in fg:
+            ax.draw_artist(a)
+            a.set_animated(False)
+        self.save_background()
+        for a in self.overlay:
+            ax.draw_artist(a)
+        self.canvas.blit(self.fig.bbox)
+        return
+
+    def save_background(self):
+        """Store the canvas as drawn for blitting"""
+
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.background_key = (self.get_plot_lims(), self.canvas.get_width_height())
+        return
+
+    def background_valid(self):
+        """Check saved background still matches the view"""
+
+        key = (self.get_plot_lims(), self.canvas.get_width_height())
+        return self.background is not None and key == self.background_key
+
+    def blit(self):
+        """Draw only the overlay over the saved background. If the background
+        is stale a full draw is scheduled, which draws the overlay too."""
+
+        if not self.background_valid():
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for a in self.overlay:
+            self.ax.draw_artist(a)
+        self.canvas.blit(self.fig.bbox)
         return
 
     def onpress(self, event):
@@ -1323,12 +1433,11 @@ class CustomPlotViewer(PlotViewer):
         #print('click: %s,%s' %(x,y))
         #c = plt.Circle([x,y], 600, color='g', alpha=.5)
         #self.ax.add_patch(c)
-        self.canvas.draw()
         df = self.app.meta_table.model.df
         pad=500
         if x is None:
             return
-        found = df.cx[x-pad:x+pad, y-pad:y+pad]
+        found = tools.get_in_region(df, x-pad, x+pad, y-pad, y+pad)
         if len(found)>0:
             self.app.sample_details(found.iloc[0])
         return
@@ -1541,10 +1650,9 @@ class TreeViewer(QWidget):
         self.kwargs = kwargs
         canvas = trees.draw_tree(treefile,  df,
                              width=self.width, height=self.height, **kwargs)
-        toyplot.html.render(canvas, "temp.html")
-        with open('temp.html', 'r') as f:
-            html = f.read()
-            self.browser.setHtml(html)
+        #render to a string rather than through a temp file
+        html = toyplot.html.tostring(canvas)
+        self.browser.setHtml(html)
         return
 
     def update(self):
@@ -1688,7 +1796,7 @@ class ScratchPad(QWidget):
         for i in items:
             if 'file' in items[i]:
                 iconfile = os.path.join(iconpath,items[i]['file']+'.svg')
-                icon = QIcon(iconfile)
+                icon = getIcon(iconfile)
             else:
                 icon = QIcon.fromTheme(items[i]['icon'])
             btn = QAction(icon, i, self)
@@ -1920,7 +2028,7 @@ class PreferencesDialog(QDialog):
                 '%Y-%m-%d %H:%M:%S','%Y-%m-%d %H:%M',
                 '%d-%m-%Y %H:%M:%S','%d-%m-%Y %H:%M',
                 '%Y','%m','%d','%b']
-        cpus=os.cpu_count()
+        cpus=core.get_cpu_count()
         self.opts = {
                 'FONT':{'type':'font','default':options['FONT'],'label':'Font'},
                 'FONTSIZE':{'type':'spinbox','default':options['FONTSIZE'],'range':(5,40),
@@ -2091,14 +2199,16 @@ class ManageSelectionsDialog(QDialog):
 class Worker(QtCore.QRunnable):
     """Worker thread for running background tasks."""
     #https://www.learnpyqt.com/courses/concurrent-execution/multithreading-pyqt-applications-qthreadpool/
-    def __init__(self, fn, *args, **kwargs):
+    def __init__(self, fn, *args, report_progress=False, **kwargs):
         super(Worker, self).__init__()
         # Store constructor arguments (re-used for processing)
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
-        self.kwargs['progress_callback'] = self.signals.progress
+        #only pass the progress signal to functions that report progress
+        if report_progress == True:
+            self.kwargs['progress_callback'] = self.signals.progress
 
     @QtCore.Slot()
     def run(self):